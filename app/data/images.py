@@ -0,0 +1,376 @@
+"""Content-addressed on-disk store and request cache for generated images."""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:  # Pillow is optional; without it thumbnails fall back to the full image.
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+LOGGER = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+}
+IMAGE_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+CACHE_DIRNAME = ".cache"
+THUMBNAILS_DIRNAME = "thumbs"
+THUMBNAIL_SIZES = ("128x128", "256x256", "512x512")
+
+
+class ImageStore:
+    """Keep each image once under the SHA-256 of its bytes.
+
+    Files live in ``<root>/<first two hex chars>/<digest>.<ext>``; the digest
+    doubles as the public id and the ETag, since the bytes behind it never
+    change.
+
+    The store is bounded on its own, whether or not an :class:`ImageCache`
+    uses it: images older than ``max_age_seconds`` are removed, and so are
+    the least recently saved ones while the images exceed ``max_bytes``.
+    Saving an image that is already stored counts as saving it again.
+    Thumbnails count towards ``max_bytes`` as part of the image they were
+    made from, and go with it. ``None`` disables either bound.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        *,
+        max_bytes: Optional[int] = None,
+        max_age_seconds: Optional[float] = None,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        # image_id -> (size, saved at), oldest first; tracked only when bounded.
+        self._saved: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        # image_id -> {thumbnail size: bytes}, also included in ``_bytes``.
+        self._thumbnail_bytes: Dict[str, Dict[str, int]] = {}
+        self._bytes = 0
+        self._pruned = 0
+        if self.bounded:
+            self._scan()
+
+    @property
+    def bounded(self) -> bool:
+        return self.max_bytes is not None or self.max_age_seconds is not None
+
+    def save(self, data: bytes, mime_type: str = "image/png") -> Dict[str, object]:
+        """Write ``data`` unless an identical image is already stored."""
+        image_id = hashlib.sha256(data).hexdigest()
+        extension = IMAGE_EXTENSIONS.get(mime_type, "png")
+        path = os.path.join(self.root, image_id[:2], f"{image_id}.{extension}")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Per thread: identical images generated concurrently share ``path``.
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        elif self.bounded:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        if self.bounded:
+            with self._lock:
+                self._track(image_id, len(data), time.time())
+                self._prune(keep=image_id)
+        return {"id": image_id, "path": path, "mime_type": mime_type, "bytes": len(data)}
+
+    def save_b64(self, data_b64: str, mime_type: str = "image/png") -> Dict[str, object]:
+        """Decode a base64 payload once and store the bytes."""
+        return self.save(base64.b64decode(data_b64), mime_type)
+
+    def locate(self, image_id: str) -> Optional[Dict[str, str]]:
+        """Return the path and MIME type of a stored image, or ``None``."""
+        if not IMAGE_ID_PATTERN.match(image_id):
+            return None
+        for mime_type, extension in IMAGE_EXTENSIONS.items():
+            path = os.path.join(self.root, image_id[:2], f"{image_id}.{extension}")
+            if os.path.exists(path):
+                return {"path": path, "mime_type": mime_type}
+        return None
+
+    def thumbnail(self, image_id: str, size: str) -> Optional[Dict[str, str]]:
+        """Return a downscaled copy of a stored image, creating it on first use.
+
+        ``size`` is one of :data:`THUMBNAIL_SIZES`; the image keeps its aspect
+        ratio inside that box. Without Pillow the original image is returned.
+        """
+        stored = self.locate(image_id)
+        if stored is None or size not in THUMBNAIL_SIZES:
+            return None
+        if Image is None:
+            return stored
+
+        path = os.path.join(self.root, THUMBNAILS_DIRNAME, image_id, f"{size}.png")
+        if not os.path.exists(path):
+            width, height = (int(value) for value in size.split("x"))
+            with Image.open(stored["path"]) as source:
+                source.thumbnail((width, height))
+                buffer = io.BytesIO()
+                source.save(buffer, format="PNG", optimize=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(buffer.getvalue())
+            os.replace(tmp_path, path)
+            if self.bounded:
+                with self._lock:
+                    if image_id not in self._saved:
+                        # The image was pruned while its thumbnail was being made.
+                        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+                        return None
+                    self._add_thumbnail(image_id, size, len(buffer.getvalue()))
+                    self._prune(keep=image_id)
+        return {"path": path, "mime_type": "image/png"}
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        with self._lock:
+            return {
+                "images": len(self._saved) if self.bounded else None,
+                "bytes": self._bytes if self.bounded else None,
+                "pruned": self._pruned,
+            }
+
+    def remove(self, image_id: str) -> None:
+        """Delete a stored image and its thumbnails, ignoring ids that are not on disk."""
+        if self.bounded:
+            with self._lock:
+                self._untrack(image_id)
+        self._delete(image_id)
+
+    def _delete(self, image_id: str) -> None:
+        stored = self.locate(image_id)
+        if stored is not None:
+            try:
+                os.remove(stored["path"])
+            except FileNotFoundError:
+                pass
+        if IMAGE_ID_PATTERN.match(image_id):
+            shutil.rmtree(os.path.join(self.root, THUMBNAILS_DIRNAME, image_id), ignore_errors=True)
+
+    def _scan(self) -> None:
+        """Rebuild the saved-images index, thumbnails included, from the files on disk."""
+        found = []
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if not shard.is_dir() or len(shard.name) != 2:
+                    continue
+                for entry in os.scandir(shard.path):
+                    image_id, _, extension = entry.name.partition(".")
+                    if IMAGE_ID_PATTERN.match(image_id) and extension in IMAGE_EXTENSIONS.values():
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, image_id, stat.st_size))
+        thumbnails: Dict[str, Dict[str, int]] = {}
+        thumbnails_root = os.path.join(self.root, THUMBNAILS_DIRNAME)
+        if os.path.isdir(thumbnails_root):
+            for directory in os.scandir(thumbnails_root):
+                if directory.is_dir():
+                    thumbnails[directory.name] = {
+                        entry.name[: -len(".png")]: entry.stat().st_size
+                        for entry in os.scandir(directory.path)
+                        if entry.is_file() and entry.name.endswith(".png")
+                    }
+        with self._lock:
+            for saved_at, image_id, size in sorted(found):
+                self._track(image_id, size, saved_at)
+            for image_id, sizes in thumbnails.items():
+                if image_id in self._saved:
+                    for size, thumbnail_bytes in sizes.items():
+                        self._add_thumbnail(image_id, size, thumbnail_bytes)
+                else:
+                    # Left behind by an image removed before thumbnails were counted.
+                    shutil.rmtree(os.path.join(thumbnails_root, image_id), ignore_errors=True)
+            self._prune()
+
+    def _track(self, image_id: str, size: int, saved_at: float) -> None:
+        # Saving again moves the image to the end; its thumbnails stay counted.
+        previous = self._saved.pop(image_id, None)
+        if previous is not None:
+            self._bytes -= previous[0]
+        self._saved[image_id] = (size, saved_at)
+        self._bytes += size
+
+    def _add_thumbnail(self, image_id: str, size: str, thumbnail_bytes: int) -> None:
+        # Keyed by size: a thumbnail made twice by concurrent requests is counted once.
+        sizes = self._thumbnail_bytes.setdefault(image_id, {})
+        self._bytes += thumbnail_bytes - sizes.get(size, 0)
+        sizes[size] = thumbnail_bytes
+
+    def _untrack(self, image_id: str) -> None:
+        previous = self._saved.pop(image_id, None)
+        if previous is not None:
+            self._bytes -= previous[0]
+        self._bytes -= sum(self._thumbnail_bytes.pop(image_id, {}).values())
+
+    def _prune(self, keep: Optional[str] = None) -> None:
+        """Remove the oldest images past the age or size bound; never ``keep``."""
+        expires_before = time.time() - self.max_age_seconds if self.max_age_seconds is not None else None
+        while self._saved:
+            image_id, (_, saved_at) = next(iter(self._saved.items()))
+            if image_id == keep:
+                break
+            expired = expires_before is not None and saved_at < expires_before
+            oversize = self.max_bytes is not None and self._bytes > self.max_bytes
+            if not expired and not oversize:
+                break
+            self._untrack(image_id)
+            self._delete(image_id)
+            self._pruned += 1
+
+
+class ImageCache:
+    """Persistent map from a generation request to an image in an :class:`ImageStore`.
+
+    Entries are small JSON files under ``<store root>/.cache`` whose mtime
+    records the last use, so the LRU order survives restarts.
+
+    ``reuse_bytes`` bounds how much image data the cache offers for reuse,
+    not disk usage: when the images its entries reference exceed it, the
+    least recently used entries are dropped. Their images stay in the store,
+    since job results and earlier responses still link to them, and the
+    store's own ``max_bytes`` and ``max_age_seconds`` bound the disk. An
+    entry whose image the store removed counts as a miss.
+    """
+
+    def __init__(self, store: ImageStore, *, reuse_bytes: int) -> None:
+        self.store = store
+        self.reuse_bytes = reuse_bytes
+        self.index_dir = os.path.join(store.root, CACHE_DIRNAME)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Several keys can point to the same image: each file is counted once.
+        self._image_refs: Dict[str, int] = {}
+        self._image_bytes: Dict[str, int] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._load()
+
+    @staticmethod
+    def key(request: Dict[str, Any]) -> str:
+        """Key an ``images.generate`` request by model, size and composed prompt."""
+        parts: List[Any] = [request["model"], request["size"], request["prompt"]]
+        options = {name: request[name] for name in ("n", "quality") if name in request}
+        if options:
+            parts.append(options)
+        material = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and any(
+                self.store.locate(image["image_id"]) is None for image in self._images(entry)
+            ):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        try:
+            os.utime(self._entry_path(key))
+        except OSError:
+            pass
+        return dict(entry)
+
+    def set(self, key: str, entry: Dict[str, Any]) -> None:
+        """Record ``entry`` (``image_id``, ``bytes``, ``mime_type``...) under ``key``."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._entries:
+                self._release(self._entries[key])
+            self._entries[key] = dict(entry)
+            self._entries.move_to_end(key)
+            self._retain(entry)
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, f"{key}.json")
+
+    def _load(self) -> None:
+        if not os.path.isdir(self.index_dir):
+            return
+        loaded = []
+        for entry in os.scandir(self.index_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                loaded.append((entry.stat().st_mtime_ns, entry.name[: -len(".json")], data))
+            except (OSError, ValueError):
+                LOGGER.warning("Skipping unreadable image cache entry %s", entry.path)
+        for _, key, data in sorted(loaded):
+            self._entries[key] = data
+            self._retain(data)
+
+    @staticmethod
+    def _images(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return entry.get("variants") or [entry]
+
+    def _retain(self, entry: Dict[str, Any]) -> None:
+        for image in self._images(entry):
+            image_id = image["image_id"]
+            if image_id not in self._image_refs:
+                self._image_refs[image_id] = 0
+                self._image_bytes[image_id] = int(image.get("bytes", 0))
+                self._bytes += self._image_bytes[image_id]
+            self._image_refs[image_id] += 1
+
+    def _release(self, entry: Dict[str, Any]) -> None:
+        for image in self._images(entry):
+            image_id = image["image_id"]
+            self._image_refs[image_id] -= 1
+            if not self._image_refs[image_id]:
+                del self._image_refs[image_id]
+                self._bytes -= self._image_bytes.pop(image_id)
+
+    def _evict(self) -> None:
+        while len(self._entries) > 1 and self._bytes > self.reuse_bytes:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self._evictions += 1
+
+    def _drop(self, key: str) -> None:
+        self._release(self._entries.pop(key))
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,26 @@
+"""Background ingestion of uploaded books."""
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict
+
+from app.data.storage import book_fingerprint, get_book_text
+from app.nlp.rag import get_index
+
+LOGGER = logging.getLogger(__name__)
+
+INGEST_JOB = "ingest_book"
+
+
+def ingest_book(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Extract, cache and index an uploaded PDF so later requests reuse the work."""
+    path = payload["path"]
+    text = get_book_text(path)
+    index = get_index(text, book_fingerprint(path))
+    LOGGER.info("Book ingested: %s (%s characters)", path, len(text))
+    return {
+        "path": payload.get("relative_path", path),
+        "title": payload.get("title"),
+        "characters": len(text),
+        "chunks": len(index.chunks),
+    }
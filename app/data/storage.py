@@ -1,13 +1,43 @@
 """Utilities for managing book storage and text extraction."""
 from __future__ import annotations
 
+import atexit
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
 import os
-from typing import Dict
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Mapping, Optional
 
 import PyPDF2
 from flask import session
 
+LOGGER = logging.getLogger(__name__)
+
 ALLOWED_EXTENSIONS = {"pdf"}
+TEXT_CACHE_DIRNAME = ".text_cache"
+
+EXTRACTION_SETTINGS: Dict[str, int] = {
+    "max_workers": 1,
+    "min_pages_parallel": 64,
+}
+
+_EXTRACTION_LOCKS: Dict[str, threading.Lock] = {}
+_EXTRACTION_LOCKS_GUARD = threading.Lock()
+
+_INVALIDATION_LISTENERS: List[Callable[[str], None]] = []
+
+# Shared by every extraction; created on first use and shut down at exit.
+_EXTRACTION_POOL: Optional[ProcessPoolExecutor] = None
+_EXTRACTION_POOL_SIZE = 0
+_EXTRACTION_POOL_LOCK = threading.Lock()
+
+# Inside a worker process: the reader of the last book, reused across its page ranges.
+_WORKER_READER: Optional[tuple[str, float, PyPDF2.PdfReader]] = None
 
 
 def allowed_file(filename: str) -> bool:
@@ -21,10 +51,16 @@ def store_book_metadata(path: str, title: str) -> None:
     session["book_title"] = title
 
 
-def get_book_metadata() -> Dict[str, str]:
-    """Return the metadata of the uploaded book, ensuring the file exists."""
-    book_path = session.get("book_path")
-    book_title = session.get("book_title", "Libro sin título")
+def get_book_metadata(session_data: Optional[Mapping[str, Any]] = None) -> Dict[str, str]:
+    """Return the metadata of the uploaded book, ensuring the file exists.
+
+    ``session_data`` lets callers outside a Flask request (the ASGI entry
+    point) pass an already decoded session.
+    """
+    if session_data is None:
+        session_data = session
+    book_path = session_data.get("book_path")
+    book_title = session_data.get("book_title", "Libro sin título")
 
     if not book_path:
         raise FileNotFoundError("No hay libro cargado o seleccionado.")
@@ -34,22 +70,289 @@ def get_book_metadata() -> Dict[str, str]:
     return {"path": book_path, "title": book_title}
 
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """Extract text from a PDF using PyPDF2 while normalising empty pages."""
-    text_parts = []
+def configure_extraction(*, max_workers: int, min_pages_parallel: int) -> None:
+    """Set the process pool size and the page threshold for parallel extraction."""
+    EXTRACTION_SETTINGS["max_workers"] = max(1, int(max_workers))
+    EXTRACTION_SETTINGS["min_pages_parallel"] = max(1, int(min_pages_parallel))
+    # A pool of the previous size is replaced on next use.
+    shutdown_extraction_pool()
+
+
+def _extraction_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use.
+
+    Workers are spawned rather than forked: extraction is requested from
+    ingestion threads, and forking a multithreaded server process can copy
+    locks held by other threads.
+    """
+    global _EXTRACTION_POOL, _EXTRACTION_POOL_SIZE
+    with _EXTRACTION_POOL_LOCK:
+        if _EXTRACTION_POOL is None or _EXTRACTION_POOL_SIZE != max_workers:
+            if _EXTRACTION_POOL is not None:
+                _EXTRACTION_POOL.shutdown(wait=False)
+            _EXTRACTION_POOL = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _EXTRACTION_POOL_SIZE = max_workers
+        return _EXTRACTION_POOL
+
+
+def shutdown_extraction_pool() -> None:
+    global _EXTRACTION_POOL
+    with _EXTRACTION_POOL_LOCK:
+        pool, _EXTRACTION_POOL = _EXTRACTION_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_extraction_pool)
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract the pages in ``[start, stop)``; runs inside a worker process.
+
+    The worker keeps the reader of the last book it saw, so its later
+    ranges of the same file do not parse the PDF again.
+    """
+    global _WORKER_READER
+    mtime = os.path.getmtime(pdf_path)
+    if _WORKER_READER is None or _WORKER_READER[:2] != (pdf_path, mtime):
+        _WORKER_READER = (pdf_path, mtime, PyPDF2.PdfReader(pdf_path))
+    reader = _WORKER_READER[2]
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def _page_ranges(page_count: int, parts: int) -> List[tuple[int, int]]:
+    size = max(1, math.ceil(page_count / parts))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _extract_parallel(pdf_path: str, page_count: int, max_workers: int) -> List[str]:
+    # A few ranges per worker keeps the pool busy when some pages are heavier.
+    ranges = _page_ranges(page_count, max_workers * 4)
+    executor = _extraction_pool(max_workers)
+    futures = [executor.submit(_extract_page_range, pdf_path, start, stop) for start, stop in ranges]
+    text_parts: List[str] = []
+    try:
+        for future in futures:
+            text_parts.extend(future.result())
+    except BrokenProcessPool:
+        # A worker died; the next extraction starts a fresh pool.
+        shutdown_extraction_pool()
+        raise
+    return text_parts
+
+
+def extract_text_from_pdf(
+    pdf_path: str,
+    *,
+    max_workers: Optional[int] = None,
+    min_pages_parallel: Optional[int] = None,
+) -> str:
+    """Extract text from a PDF using PyPDF2 while normalising empty pages.
+
+    Books with at least ``min_pages_parallel`` pages are split into page
+    ranges and extracted on a process pool; the pages are stitched back in
+    order. Smaller files, or a pool of one worker, use the serial path.
+    """
+    if max_workers is None:
+        max_workers = EXTRACTION_SETTINGS["max_workers"]
+    if min_pages_parallel is None:
+        min_pages_parallel = EXTRACTION_SETTINGS["min_pages_parallel"]
+
+    text_parts: List[str] = []
     try:
         with open(pdf_path, "rb") as file:
             reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                page_text = page.extract_text() or ""
-                text_parts.append(page_text)
+            page_count = len(reader.pages)
+            if max_workers > 1 and page_count >= min_pages_parallel:
+                try:
+                    text_parts = _extract_parallel(pdf_path, page_count, max_workers)
+                except Exception as exc:
+                    LOGGER.warning("Parallel extraction failed, using serial path: %s", exc)
+                    text_parts = []
+            if not text_parts:
+                for page in reader.pages:
+                    page_text = page.extract_text() or ""
+                    text_parts.append(page_text)
     except Exception as exc:  # pragma: no cover - defensive branch
         raise Exception(f"Error al extraer texto del PDF: {exc}")
 
     return "\n".join(text_parts)
 
 
+def check_pdf(pdf_path: str) -> int:
+    """Open the PDF and return its page count without extracting any text.
+
+    Raises ``ValueError`` when the file cannot be read or has no pages, so an
+    upload can be rejected before its ingestion is queued.
+    """
+    try:
+        page_count = len(PyPDF2.PdfReader(pdf_path).pages)
+    except Exception as exc:
+        raise ValueError(f"El archivo no es un PDF válido: {exc}")
+    if page_count == 0:
+        raise ValueError("El PDF no tiene páginas.")
+    return page_count
+
+
+def file_fingerprint(pdf_path: str) -> str:
+    """Return the SHA-256 digest of the file contents."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _text_cache_paths(pdf_path: str) -> Dict[str, str]:
+    directory, filename = os.path.split(os.path.abspath(pdf_path))
+    cache_dir = os.path.join(directory, TEXT_CACHE_DIRNAME)
+    return {
+        "dir": cache_dir,
+        "meta": os.path.join(cache_dir, f"{filename}.json"),
+        "text": os.path.join(cache_dir, f"{filename}.txt"),
+    }
+
+
+def _write_atomic(path: str, content: str) -> None:
+    # One temp file per thread: concurrent readers may refresh the same meta.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def _read_cache_meta(meta_path: str) -> Optional[Dict[str, object]]:
+    try:
+        with open(meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def load_cached_text(pdf_path: str) -> Optional[str]:
+    """Return the cached text of a PDF when the entry is still fresh.
+
+    The entry is trusted directly while the file keeps the same size and
+    mtime. When only the mtime changed the content hash is recomputed, so a
+    touched-but-identical file keeps its cache.
+    """
+    paths = _text_cache_paths(pdf_path)
+    meta = _read_cache_meta(paths["meta"])
+    if meta is None:
+        return None
+
+    try:
+        stats = os.stat(pdf_path)
+    except OSError:
+        return None
+
+    if meta.get("size") != stats.st_size:
+        return None
+
+    if meta.get("mtime_ns") != stats.st_mtime_ns:
+        if meta.get("sha256") != file_fingerprint(pdf_path):
+            return None
+        meta["mtime_ns"] = stats.st_mtime_ns
+        _write_atomic(paths["meta"], json.dumps(meta))
+
+    try:
+        with open(paths["text"], "r", encoding="utf-8") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def store_cached_text(pdf_path: str, text: str) -> Dict[str, object]:
+    """Persist the extracted text next to the upload and return its cache entry."""
+    paths = _text_cache_paths(pdf_path)
+    os.makedirs(paths["dir"], exist_ok=True)
+    stats = os.stat(pdf_path)
+    meta: Dict[str, object] = {
+        "sha256": file_fingerprint(pdf_path),
+        "mtime_ns": stats.st_mtime_ns,
+        "size": stats.st_size,
+    }
+    # The text goes first so a fresh meta never points to a missing payload.
+    _write_atomic(paths["text"], text)
+    _write_atomic(paths["meta"], json.dumps(meta))
+    return meta
+
+
+def book_fingerprint(pdf_path: str) -> str:
+    """Return the content hash of a PDF, reusing the cached one while fresh."""
+    meta = _read_cache_meta(_text_cache_paths(pdf_path)["meta"])
+    if meta is not None and meta.get("sha256"):
+        stats = os.stat(pdf_path)
+        if meta.get("size") == stats.st_size and meta.get("mtime_ns") == stats.st_mtime_ns:
+            return str(meta["sha256"])
+    return file_fingerprint(pdf_path)
+
+
+def add_invalidation_listener(callback: Callable[[str], None]) -> None:
+    """Call ``callback(fingerprint)`` whenever a cached book is deleted or replaced."""
+    _INVALIDATION_LISTENERS.append(callback)
+
+
+def _notify_invalidated(fingerprint: str) -> None:
+    for callback in _INVALIDATION_LISTENERS:
+        try:
+            callback(fingerprint)
+        except Exception:  # pragma: no cover - listeners must not break storage
+            LOGGER.exception("Invalidation listener failed for %s", fingerprint)
+
+
+def invalidate_text_cache(pdf_path: str) -> None:
+    """Drop the cached text of a PDF, ignoring entries that do not exist."""
+    paths = _text_cache_paths(pdf_path)
+    meta = _read_cache_meta(paths["meta"])
+    if meta is not None and meta.get("sha256"):
+        _notify_invalidated(str(meta["sha256"]))
+    with _EXTRACTION_LOCKS_GUARD:
+        _EXTRACTION_LOCKS.pop(os.path.abspath(pdf_path), None)
+    for key in ("meta", "text"):
+        try:
+            os.remove(paths[key])
+        except FileNotFoundError:
+            continue
+
+
+def _extraction_lock(pdf_path: str) -> threading.Lock:
+    key = os.path.abspath(pdf_path)
+    with _EXTRACTION_LOCKS_GUARD:
+        lock = _EXTRACTION_LOCKS.get(key)
+        if lock is None:
+            lock = _EXTRACTION_LOCKS[key] = threading.Lock()
+        return lock
+
+
+def get_book_text(pdf_path: str) -> str:
+    """Return the text of a PDF, extracting it only when the cache is stale.
+
+    Concurrent callers for the same file wait for a single extraction, so a
+    chat request that arrives while the upload is still being ingested reuses
+    that work instead of parsing the PDF a second time.
+    """
+    cached = load_cached_text(pdf_path)
+    if cached is not None:
+        return cached
+
+    with _extraction_lock(pdf_path):
+        cached = load_cached_text(pdf_path)
+        if cached is not None:
+            return cached
+        previous = _read_cache_meta(_text_cache_paths(pdf_path)["meta"])
+        text = extract_text_from_pdf(pdf_path)
+        meta = store_cached_text(pdf_path, text)
+        if previous and previous.get("sha256") not in (None, meta["sha256"]):
+            # The file was replaced in place: derived data of the old content is stale.
+            _notify_invalidated(str(previous["sha256"]))
+        return text
+
+
 def load_book_text() -> str:
     """Load the text of the current book from disk."""
     metadata = get_book_metadata()
-    return extract_text_from_pdf(metadata["path"])
+    return get_book_text(metadata["path"])
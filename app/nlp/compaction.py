@@ -0,0 +1,75 @@
+"""Prompt compaction for the quality loop.
+
+The evaluator only needs the part of the fragment a candidate relies on to
+judge it. :func:`compact_fragment` keeps the fragment sentences that share a
+word n-gram with the candidate (quotes, but also close paraphrases) and
+drops the rest, so retries stop resending the whole retrieved context.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import List, Set, Tuple
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?…])\s+|\n{2,}")
+NGRAM_SIZE = 3
+OMISSION_MARK = "[…]"
+
+
+def _words(text: str) -> List[str]:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return re.findall(r"\w+", folded)
+
+
+def _ngrams(words: List[str], size: int) -> Set[Tuple[str, ...]]:
+    return {tuple(words[start:start + size]) for start in range(len(words) - size + 1)}
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+def compact_fragment(fragment: str, candidate: str, *, ngram: int = NGRAM_SIZE, neighbours: int = 0) -> str:
+    """Keep the sentences of ``fragment`` that share an ``ngram``-word sequence with ``candidate``.
+
+    ``neighbours`` also keeps that many sentences on each side of a match.
+    Gaps are marked with ``[…]``. When nothing matches the whole fragment is
+    returned, since the evaluator then needs it to judge the anchoring.
+    """
+    sentences = split_sentences(fragment)
+    candidate_ngrams = _ngrams(_words(candidate), ngram)
+    if not sentences or not candidate_ngrams:
+        return fragment
+
+    matched = [
+        position
+        for position, sentence in enumerate(sentences)
+        if _ngrams(_words(sentence), ngram) & candidate_ngrams
+    ]
+    if not matched:
+        return fragment
+
+    kept = sorted(
+        {
+            position
+            for match in matched
+            for position in range(max(0, match - neighbours), min(len(sentences), match + neighbours + 1))
+        }
+    )
+    if len(kept) == len(sentences):
+        return fragment
+
+    parts: List[str] = []
+    previous = -1
+    for position in kept:
+        if parts and position != previous + 1:
+            parts.append(OMISSION_MARK)
+        parts.append(sentences[position])
+        previous = position
+    text = " ".join(parts)
+    if kept[0] > 0:
+        text = f"{OMISSION_MARK} {text}"
+    if kept[-1] < len(sentences) - 1:
+        text = f"{text} {OMISSION_MARK}"
+    return text
@@ -1,9 +1,48 @@
 """Lightweight retrieval helpers for the tutoring orchestrator."""
 from __future__ import annotations
 
+import hashlib
+import logging
 import math
 import re
-from typing import Dict, List, Tuple
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.nlp.tokens import CONTEXT_TOKEN_BUDGET, count_tokens, truncate_to_tokens
+from app.utils.cache import LRUCache
+
+try:  # NumPy is optional; the pure-Python scorer is always available.
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+LOGGER = logging.getLogger(__name__)
+
+CONTEXT_CHUNK_SIZE = 220
+CONTEXT_CHUNK_OVERLAP = 40
+# Ranked chunks considered when packing a context; the token budget decides how many fit.
+CONTEXT_CANDIDATES = 6
+MAX_CACHED_INDEXES = 8
+
+SCORERS = ("heuristic", "bm25")
+BACKENDS = ("python", "numpy")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Accent-folded, so they match the output of ``_fold``.
+SPANISH_STOPWORDS = frozenset(
+    """
+    a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada como con contra
+    cual cuales cuando de del desde donde dos el ella ellas ello ellos en entre era eran es esa
+    esas ese eso esos esta estaba estaban estan estar este esto estos fue fueron ha habia han
+    hasta hay la las le les lo los mas me mi mis mucho muy nada ni no nos nosotros o os otra
+    otras otro otros para pero poco por porque que quien quienes se sea segun ser si sido sin
+    sobre solo son su sus tambien tan tanto te tenia tiene todo todos tu tus un una unas uno
+    unos y ya yo
+    """.split()
+)
 
 
 def _normalise(text: str) -> str:
@@ -14,6 +53,21 @@ def _tokenise(text: str) -> List[str]:
     return re.findall(r"\w+", text.lower())
 
 
+def _fold(token: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", token)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _content_terms(tokens: List[str]) -> List[str]:
+    """Accent-fold tokens and drop Spanish stopwords for BM25."""
+    terms = []
+    for token in tokens:
+        folded = _fold(token)
+        if folded not in SPANISH_STOPWORDS:
+            terms.append(folded)
+    return terms
+
+
 def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 120) -> List[str]:
     words = text.split()
     if not words:
@@ -28,48 +82,431 @@ def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 120) -> List[st
     return chunks
 
 
-def _score_chunk(chunk: str, query_tokens: List[str]) -> float:
-    if not query_tokens:
-        return 0.0
-    chunk_tokens = _tokenise(chunk)
-    if not chunk_tokens:
+def _score_counts(term_freqs: Counter, length: int, query_tokens: List[str]) -> float:
+    if not query_tokens or not length:
         return 0.0
-    hits = sum(chunk_tokens.count(token) for token in query_tokens)
+    hits = sum(term_freqs[token] for token in query_tokens)
     if hits == 0:
         return 0.0
     # Inverse length factor to prefer concise passages
-    return hits / math.sqrt(len(chunk_tokens))
+    return hits / math.sqrt(length)
 
 
-def build_context(book_text: str, query: str | None = None, max_chars: int = 1800) -> Dict[str, str]:
-    """Return a relevant context window and anchor snippet for a query."""
-    cleaned_text = _normalise(book_text)
-    if not cleaned_text:
-        return {"context": "", "anchor": ""}
+def _score_chunk(chunk: str, query_tokens: List[str]) -> float:
+    if not query_tokens:
+        return 0.0
+    chunk_tokens = _tokenise(chunk)
+    return _score_counts(Counter(chunk_tokens), len(chunk_tokens), query_tokens)
+
+
+class RetrievalIndex:
+    """Chunks, term frequencies and term postings of one book, built once per text.
+
+    Two views are kept per chunk: the raw tokens used by the ``heuristic``
+    scorer and the accent-folded content terms used by ``bm25``, together
+    with the document frequencies and IDF of the latter.
+    """
+
+    def __init__(self, book_text: str) -> None:
+        self.cleaned_text = _normalise(book_text)
+        self.words: List[str] = self.cleaned_text.split()
+        self.chunk_step = max(CONTEXT_CHUNK_SIZE - CONTEXT_CHUNK_OVERLAP, 1)
+        self.chunks: List[str] = (
+            _chunk_text(self.cleaned_text, chunk_size=CONTEXT_CHUNK_SIZE, overlap=CONTEXT_CHUNK_OVERLAP)
+            if self.cleaned_text
+            else []
+        )
+        self.term_freqs: List[Counter] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+        self.bm25_term_freqs: List[Counter] = []
+        self.bm25_lengths: List[int] = []
+        self.bm25_postings: Dict[str, List[int]] = {}
+        for chunk_id, chunk in enumerate(self.chunks):
+            tokens = _tokenise(chunk)
+            term_freqs = Counter(tokens)
+            self.term_freqs.append(term_freqs)
+            self.lengths.append(len(tokens))
+            for token in term_freqs:
+                self.postings.setdefault(token, []).append(chunk_id)
+
+            terms = _content_terms(tokens)
+            bm25_term_freqs = Counter(terms)
+            self.bm25_term_freqs.append(bm25_term_freqs)
+            self.bm25_lengths.append(len(terms))
+            for term in bm25_term_freqs:
+                self.bm25_postings.setdefault(term, []).append(chunk_id)
+
+        chunk_count = len(self.chunks)
+        self.avg_bm25_length = sum(self.bm25_lengths) / chunk_count if chunk_count else 0.0
+        self.doc_freqs: Dict[str, int] = {term: len(ids) for term, ids in self.bm25_postings.items()}
+        self.idf: Dict[str, float] = {
+            term: math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+            for term, df in self.doc_freqs.items()
+        }
+        self._matrices: Dict[str, Tuple] = {}
+        self._matrices_lock = threading.Lock()
+
+    @staticmethod
+    def _candidates(postings: Dict[str, List[int]], terms: List[str]) -> List[int]:
+        chunk_ids = set()
+        for term in set(terms):
+            chunk_ids.update(postings.get(term, ()))
+        return sorted(chunk_ids)
+
+    def candidates(self, query_tokens: List[str]) -> List[int]:
+        """Return, in book order, the chunks containing at least one query term."""
+        return self._candidates(self.postings, query_tokens)
+
+    def _bm25_length_norm(self, chunk_id: int) -> float:
+        return BM25_K1 * (
+            1 - BM25_B + BM25_B * self.bm25_lengths[chunk_id] / (self.avg_bm25_length or 1.0)
+        )
+
+    def _bm25_score(self, chunk_id: int, query_terms: List[str]) -> float:
+        term_freqs = self.bm25_term_freqs[chunk_id]
+        length_norm = self._bm25_length_norm(chunk_id)
+        score = 0.0
+        for term in query_terms:
+            tf = term_freqs[term]
+            if tf:
+                score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + length_norm)
+        return score
+
+    def _query_plan(self, query_tokens: List[str], scorer: str) -> Tuple[str, List[str]]:
+        """Resolve the effective scorer and the query terms it works on."""
+        if scorer not in SCORERS:
+            raise ValueError(f"Scorer de recuperación desconocido: {scorer}")
+        if scorer == "bm25":
+            query_terms = list(dict.fromkeys(_content_terms(query_tokens)))
+            if query_terms:
+                return "bm25", query_terms
+        # Queries made only of stopwords fall back to the heuristic scorer.
+        return "heuristic", query_tokens
+
+    def _score_python(self, scorer: str, query_terms: List[str]) -> List[Tuple[float, int]]:
+        scored: List[Tuple[float, int]] = []
+        if scorer == "bm25":
+            for chunk_id in self._candidates(self.bm25_postings, query_terms):
+                score = self._bm25_score(chunk_id, query_terms)
+                if score > 0:
+                    scored.append((score, chunk_id))
+        else:
+            for chunk_id in self.candidates(query_terms):
+                score = _score_counts(self.term_freqs[chunk_id], self.lengths[chunk_id], query_terms)
+                if score > 0:
+                    scored.append((score, chunk_id))
+        return scored
+
+    def _term_matrix(self, scorer: str):
+        """Return the sparse chunk x term matrix of a scorer, stored column-wise.
+
+        Each column holds the contribution of one term to every chunk
+        containing it (BM25 weight, or raw frequency for the heuristic), so
+        scoring a query is a single sparse matrix-vector product. Built
+        lazily, once even under concurrent queries, and kept for the life of
+        the index.
+        """
+        matrix = self._matrices.get(scorer)
+        if matrix is not None:
+            return matrix
+        with self._matrices_lock:
+            matrix = self._matrices.get(scorer)
+            if matrix is None:
+                matrix = self._matrices[scorer] = self._build_term_matrix(scorer)
+        return matrix
+
+    def _build_term_matrix(self, scorer: str):
+        postings = self.bm25_postings if scorer == "bm25" else self.postings
+        columns: Dict[str, int] = {}
+        indptr = [0]
+        indices: List[int] = []
+        data: List[float] = []
+        for column, (term, chunk_ids) in enumerate(postings.items()):
+            columns[term] = column
+            indices.extend(chunk_ids)
+            if scorer == "bm25":
+                idf = self.idf[term]
+                for chunk_id in chunk_ids:
+                    tf = self.bm25_term_freqs[chunk_id][term]
+                    data.append(idf * tf * (BM25_K1 + 1) / (tf + self._bm25_length_norm(chunk_id)))
+            else:
+                data.extend(self.term_freqs[chunk_id][term] for chunk_id in chunk_ids)
+            indptr.append(len(indices))
+
+        # The heuristic divides the summed hits by sqrt(length) afterwards,
+        # exactly like the Python path, so both backends rank ties alike.
+        row_scale = (
+            None if scorer == "bm25" else np.sqrt(np.asarray(self.lengths, dtype=np.float64))
+        )
+        return (
+            columns,
+            np.asarray(indptr, dtype=np.int64),
+            np.asarray(indices, dtype=np.int64),
+            np.asarray(data, dtype=np.float64),
+            row_scale,
+        )
+
+    def _score_numpy(self, scorer: str, query_terms: List[str], limit: int) -> List[Tuple[float, int]]:
+        columns, indptr, indices, data, row_scale = self._term_matrix(scorer)
+        # The heuristic counts repeated query tokens; BM25 terms are already unique.
+        weights = Counter(term for term in query_terms if term in columns)
+        if not weights:
+            return []
+
+        rows = []
+        values = []
+        for term, weight in weights.items():
+            column = columns[term]
+            start, stop = indptr[column], indptr[column + 1]
+            rows.append(indices[start:stop])
+            values.append(data[start:stop] * weight)
+        scores = np.bincount(
+            np.concatenate(rows), weights=np.concatenate(values), minlength=len(self.chunks)
+        )
+        if row_scale is not None:
+            scores = scores / row_scale
+
+        positive = np.count_nonzero(scores > 0)
+        if not positive:
+            return []
+        k = min(limit, positive)
+        top = np.argpartition(-scores, k - 1)[:k]
+        # Keep every chunk tied with the k-th score so the final order matches the Python path.
+        threshold = scores[top].min()
+        selected = np.flatnonzero(scores >= threshold)
+        return [(float(scores[chunk_id]), int(chunk_id)) for chunk_id in selected]
+
+    def search(
+        self,
+        query_tokens: List[str],
+        limit: int = 3,
+        scorer: str = "heuristic",
+        backend: str = "python",
+    ) -> List[str]:
+        """Return up to ``limit`` chunks with a positive score, best first."""
+        return [self.chunks[chunk_id] for chunk_id in self.ranked(query_tokens, limit, scorer, backend)]
+
+    def ranked(
+        self,
+        query_tokens: List[str],
+        limit: int = 3,
+        scorer: str = "heuristic",
+        backend: str = "python",
+    ) -> List[int]:
+        """Ids of the ``limit`` best chunks with a positive score, best first."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend de recuperación desconocido: {backend}")
 
+        scorer, query_terms = self._query_plan(query_tokens, scorer)
+        if backend == "numpy" and np is not None and self.chunks:
+            scored = self._score_numpy(scorer, query_terms, limit)
+        else:
+            scored = self._score_python(scorer, query_terms)
+        # Ties keep book order, as the original stable sort over all chunks did.
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [chunk_id for _, chunk_id in scored[:limit]]
+
+    def pack(self, chunk_ids: List[int], max_tokens: int) -> str:
+        """Join ranked chunks within ``max_tokens``, sending overlapping words once.
+
+        Neighbouring chunks share ``CONTEXT_CHUNK_OVERLAP`` words; a chunk only
+        costs the words not already selected, and contiguous selections are
+        merged back into a single passage. Passages keep the order of their
+        best-ranked chunk.
+        """
+        selected: Dict[int, int] = {}  # word position -> rank of the chunk that added it
+        used = 0
+        for rank, chunk_id in enumerate(chunk_ids):
+            start = chunk_id * self.chunk_step
+            new_words = [
+                position
+                for position in range(start, min(start + CONTEXT_CHUNK_SIZE, len(self.words)))
+                if position not in selected
+            ]
+            if not new_words:
+                continue
+            cost = count_tokens(" ".join(self.words[position] for position in new_words))
+            if used + cost > max_tokens:
+                if not selected:
+                    return truncate_to_tokens(self.chunks[chunk_id], max_tokens)
+                continue
+            used += cost
+            for position in new_words:
+                selected[position] = rank
+
+        passages: List[List[int]] = []
+        for position in sorted(selected):
+            if passages and passages[-1][-1] == position - 1:
+                passages[-1].append(position)
+            else:
+                passages.append([position])
+        passages.sort(key=lambda positions: min(selected[position] for position in positions))
+        return "\n\n".join(" ".join(self.words[position] for position in positions) for positions in passages)
+
+
+_INDEXES: "OrderedDict[str, RetrievalIndex]" = OrderedDict()
+_INDEXES_LOCK = threading.Lock()
+
+
+def _context_size(value: Dict[str, str]) -> int:
+    # Rough UTF-8 footprint of the cached strings.
+    return len(value["context"].encode("utf-8")) + len(value["anchor"].encode("utf-8"))
+
+
+# Results keyed by (book key, normalised query, max_tokens, scorer).
+_CONTEXT_CACHE = LRUCache(
+    max_entries=4096,
+    max_bytes=8 * 1024 * 1024,
+    ttl_seconds=6 * 60 * 60,
+    sizeof=_context_size,
+)
+
+
+def _text_key(book_text: str) -> str:
+    return hashlib.sha1(book_text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def get_index(book_text: str, book_key: Optional[str] = None) -> RetrievalIndex:
+    """Return the retrieval index of a book, building it on first use.
+
+    ``book_key`` identifies the book (the file fingerprint); without it the
+    text itself is hashed. Only the most recently used indexes are kept.
+    """
+    key = book_key or _text_key(book_text)
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(key)
+        if index is not None:
+            _INDEXES.move_to_end(key)
+            return index
+
+    index = RetrievalIndex(book_text)
+    with _INDEXES_LOCK:
+        _INDEXES[key] = index
+        _INDEXES.move_to_end(key)
+        while len(_INDEXES) > MAX_CACHED_INDEXES:
+            _INDEXES.popitem(last=False)
+    return index
+
+
+def invalidate_index(book_key: str) -> None:
+    """Forget the index built for a book, e.g. after it is deleted."""
+    with _INDEXES_LOCK:
+        _INDEXES.pop(book_key, None)
+
+
+def configure_context_cache(
+    *,
+    max_entries: int,
+    max_bytes: int,
+    ttl_seconds: Optional[float],
+) -> None:
+    """Resize the ``build_context`` result cache and drop its current content."""
+    _CONTEXT_CACHE.max_entries = max_entries
+    _CONTEXT_CACHE.max_bytes = max_bytes
+    _CONTEXT_CACHE.ttl_seconds = ttl_seconds
+    _CONTEXT_CACHE.clear()
+
+
+def context_cache_stats() -> Dict[str, int]:
+    return _CONTEXT_CACHE.stats()
+
+
+def invalidate_book(book_key: str) -> None:
+    """Drop the index and every memoised context of a deleted or replaced book."""
+    invalidate_index(book_key)
+    _CONTEXT_CACHE.invalidate(lambda key: key[0] == book_key)
+
+
+_NUMPY_WARNING_ISSUED = False
+
+
+def validate_retrieval(scorer: str, backend: str) -> Tuple[str, str]:
+    """Check a configured scorer and backend, for startup rather than the first query.
+
+    Raises ``ValueError`` for unknown names; ``numpy`` without NumPy
+    installed falls back to ``python`` with a warning.
+    """
+    if scorer not in SCORERS:
+        raise ValueError(f"Scorer de recuperación desconocido: {scorer} (opciones: {', '.join(SCORERS)})")
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de recuperación desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    if backend == "numpy" and np is None:
+        _warn_numpy_missing()
+        backend = "python"
+    return scorer, backend
+
+
+def _warn_numpy_missing() -> None:
+    global _NUMPY_WARNING_ISSUED
+    if not _NUMPY_WARNING_ISSUED:
+        LOGGER.warning("NumPy is not installed; retrieval uses the Python backend.")
+        _NUMPY_WARNING_ISSUED = True
+
+
+def build_context(
+    book_text: str,
+    query: str | None = None,
+    *,
+    max_tokens: int = CONTEXT_TOKEN_BUDGET,
+    book_key: Optional[str] = None,
+    scorer: str = "heuristic",
+    backend: str = "python",
+) -> Dict[str, str]:
+    """Return a relevant context window and anchor snippet for a query.
+
+    ``scorer`` selects the ranking: ``heuristic`` (query hits over the square
+    root of the chunk length) or ``bm25`` (IDF-weighted, accent-folded and
+    without Spanish stopwords). ``backend="numpy"`` scores every chunk with
+    one sparse matrix-vector product and falls back to Python without NumPy.
+
+    The best chunks are packed into ``max_tokens`` prompt tokens, counting the
+    words they share with each other only once (see :meth:`RetrievalIndex.pack`).
+    ``max_tokens`` is keyword-only so that a caller still passing the old
+    positional ``max_chars`` fails instead of sending four times the text.
+
+    Results are memoised per book, normalised query, ``max_tokens`` and
+    scorer; both backends return the same ranking so it is not part of the key.
+    """
+    book_key = book_key or _text_key(book_text)
     query_tokens = _tokenise(query or "")
+    cache_key = (book_key, " ".join(query_tokens), max_tokens, scorer)
+    cached = _CONTEXT_CACHE.get(cache_key)
+    if cached is not None:
+        return dict(cached)
 
-    if not query_tokens:
-        excerpt = cleaned_text[:max_chars]
-        return {"context": excerpt, "anchor": excerpt[:300]}
+    result = _build_context(book_text, query_tokens, max_tokens, book_key, scorer, backend)
+    _CONTEXT_CACHE.set(cache_key, result)
+    return dict(result)
 
-    candidate_chunks = _chunk_text(cleaned_text, chunk_size=220, overlap=40)
-    if not candidate_chunks:
-        candidate_chunks = [cleaned_text[:max_chars]]
 
-    scored_chunks: List[Tuple[float, str]] = [
-        (_score_chunk(chunk, query_tokens), chunk) for chunk in candidate_chunks
-    ]
+def _build_context(
+    book_text: str,
+    query_tokens: List[str],
+    max_tokens: int,
+    book_key: str,
+    scorer: str,
+    backend: str,
+) -> Dict[str, str]:
+    index = get_index(book_text, book_key)
+    cleaned_text = index.cleaned_text
+    if not cleaned_text:
+        return {"context": "", "anchor": ""}
 
-    scored_chunks.sort(key=lambda item: item[0], reverse=True)
+    # Enough characters for any budget, so the opening is never tokenised whole.
+    opening = cleaned_text[: max_tokens * 8]
+    if not query_tokens:
+        excerpt = truncate_to_tokens(opening, max_tokens)
+        return {"context": excerpt, "anchor": excerpt[:300]}
 
-    best_chunks = [chunk for score, chunk in scored_chunks if score > 0][:3]
+    if backend == "numpy" and np is None:
+        _warn_numpy_missing()
+    best_chunks = index.ranked(query_tokens, limit=CONTEXT_CANDIDATES, scorer=scorer, backend=backend)
     if not best_chunks:
-        excerpt = cleaned_text[:max_chars]
+        excerpt = truncate_to_tokens(opening, max_tokens)
     else:
-        excerpt = "\n\n".join(best_chunks)
+        excerpt = index.pack(best_chunks, max_tokens)
 
-    excerpt = excerpt[:max_chars]
     anchor = excerpt.split(". ")[:2]
     anchor_text = ". ".join(anchor).strip()
 
@@ -0,0 +1,132 @@
+"""Token counting and token-budgeted text packing for prompt context.
+
+Counts use ``tiktoken``'s ``cl100k_base`` encoding (the one used by
+``gpt-3.5-turbo``) when the package and its encoding file are available;
+otherwise a local approximation splits words into pieces of up to four
+characters, which stays within a few percent for Spanish prose.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import re
+import threading
+from typing import Any, Iterable, List, Optional
+
+try:  # tiktoken is optional; the approximation is always available.
+    import tiktoken
+except ImportError:  # pragma: no cover - depends on the environment
+    tiktoken = None
+
+LOGGER = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+APPROX_CHARS_PER_TOKEN = 4
+
+# Per-stage budgets for book text placed in a prompt.
+CONTEXT_TOKEN_BUDGET = 450
+IMAGE_FRAGMENT_TOKENS = 300
+IMAGE_GENERATION_FRAGMENT_TOKENS = 225
+IMAGE_PROMPT_FRAGMENT_TOKENS = 150
+VISUAL_PROMPT_CONTEXT_TOKENS = 375
+# Opt-in opening of the book placed ahead of the per-query fragment in
+# text-worker prompts, for models with provider-side prompt caching. Off by
+# default: the opening is unrelated to the question and, cached or not, its
+# tokens are still billed.
+BOOK_PREFIX_TOKENS = 0
+
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+
+_ENCODING: Any = None
+_ENCODING_LOCK = threading.Lock()
+_ENCODING_FAILED = False
+
+
+def _encoding() -> Any:
+    """Load the tiktoken encoding once; ``None`` selects the approximation."""
+    global _ENCODING, _ENCODING_FAILED
+    if _ENCODING is not None or _ENCODING_FAILED or tiktoken is None:
+        return _ENCODING
+    with _ENCODING_LOCK:
+        if _ENCODING is None and not _ENCODING_FAILED:
+            try:
+                _ENCODING = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception:  # pragma: no cover - the encoding file may need a download
+                LOGGER.warning("Could not load the %s encoding; token counts are approximate", ENCODING_NAME)
+                _ENCODING_FAILED = True
+    return _ENCODING
+
+
+def _piece_tokens(piece: str) -> int:
+    return max(1, math.ceil(len(piece) / APPROX_CHARS_PER_TOKEN))
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens ``text`` takes in a prompt."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(_piece_tokens(piece) for piece in PIECE_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` within ``max_tokens``, cut at a word boundary."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        prefix = encoding.decode(tokens[:max_tokens])
+        # The cut may split the last word (or a multi-byte character): drop it.
+        cut = prefix.rfind(" ")
+        return prefix[:cut] if cut > 0 else prefix
+
+    used = 0
+    end = 0
+    for match in PIECE_PATTERN.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            break
+        end = match.end()
+    return text[:end]
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(re.findall(r"\w+", sentence.lower()))
+
+
+def pack_texts(texts: Iterable[Optional[str]], max_tokens: int) -> str:
+    """Join ``texts`` within ``max_tokens``, skipping sentences already included.
+
+    Fragments that come from overlapping retrievals often repeat whole
+    sentences; each is sent once. Texts are taken in order, so the first one
+    has priority when the budget runs out.
+    """
+    seen = set()
+    parts: List[str] = []
+    used = 0
+    for text in texts:
+        sentences = []
+        for sentence in SENTENCE_PATTERN.split((text or "").strip()):
+            key = _sentence_key(sentence)
+            if not key or key in seen:
+                continue
+            cost = count_tokens(sentence) + 1
+            if used + cost > max_tokens:
+                if not parts and not sentences:
+                    sentences.append(truncate_to_tokens(sentence, max_tokens))
+                    used = max_tokens
+                break
+            seen.add(key)
+            used += cost
+            sentences.append(sentence)
+        if sentences:
+            parts.append(" ".join(sentences))
+        if used >= max_tokens:
+            break
+    return "\n\n".join(parts)
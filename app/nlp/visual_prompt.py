@@ -5,6 +5,7 @@ from typing import Any, Dict, Optional
 
 from openai import OpenAI
 
+from app.nlp.tokens import VISUAL_PROMPT_CONTEXT_TOKENS, truncate_to_tokens
 from app.utils.usage import extract_usage
 
 SYSTEM_PROMPT = (
@@ -34,7 +35,7 @@ def generate_book_image_prompt(
     user_content_parts = [
         f"Título del libro: {cleaned_title}",
         f"Edad objetivo: {age} años",
-        f"Idea principal del libro:\n{triple}{context[:1500]}{triple}",
+        f"Idea principal del libro:\n{triple}{truncate_to_tokens(context, VISUAL_PROMPT_CONTEXT_TOKENS)}{triple}",
         (
             f"Instrucción adicional del usuario: {focus_clause}"
             if focus_clause
@@ -0,0 +1,70 @@
+"""Response cache placed in front of ``Orchestrator.handle``."""
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, Hashable, Optional
+
+from app.utils.cache import MemoryCache
+
+
+def age_band(age: int) -> str:
+    """Return the age band used by the workers to tune their guidance."""
+    if age <= 8:
+        return "<=8"
+    if age <= 12:
+        return "9-12"
+    return "13+"
+
+
+def normalise_question(text: str) -> str:
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+
+class ResponseCache:
+    """Keep approved answers per (worker, age band, book, normalised question)."""
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 512,
+        ttl_seconds: Optional[float] = None,
+        policy: str = "lru",
+    ) -> None:
+        self._cache = MemoryCache(
+            policy=policy,
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds,
+        )
+
+    @staticmethod
+    def key(worker_name: str, payload: Dict[str, Any]) -> Optional[Hashable]:
+        book_key = payload.get("book_key")
+        if not book_key:
+            return None
+        return (
+            book_key,
+            worker_name,
+            age_band(int(payload.get("age", 9))),
+            normalise_question(payload.get("message", "")),
+        )
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        result = json.loads(cached)
+        result["trace"]["cached"] = True
+        for event in result.get("usage") or []:
+            event["cached"] = True
+        return result
+
+    def set(self, key: Hashable, result: Dict[str, Any]) -> None:
+        # Stored serialised so callers can never mutate a cached answer.
+        self._cache.set(key, json.dumps(result))
+
+    def invalidate_book(self, book_key: str) -> None:
+        self._cache.invalidate(lambda key: key[0] == book_key)
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
@@ -1,17 +1,91 @@
 """Core orchestrator coordinating workers and quality loop."""
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import Any, Dict, List, Optional
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generator, Iterator, List, NamedTuple, Optional, Tuple, Union
 
+from app.data.images import ImageCache
+from app.workers.image import DEFAULT_IMAGE_SIZE
 from app.nlp.rag import build_context
-from app.quality.evaluator import ResponseEvaluator
+from app.nlp.tokens import BOOK_PREFIX_TOKENS, CONTEXT_TOKEN_BUDGET, IMAGE_FRAGMENT_TOKENS, pack_texts
+from app.orchestrator.cache import ResponseCache
+from app.quality.evaluator import CHECKLISTS, ResponseEvaluator
 from app.quality.optimizer import ResponseOptimizer
+from app.quality.prechecks import apply_prechecks, failed_evaluation, run_prechecks
 from app.quality.image_prompt_evaluator import ImagePromptEvaluator
 from app.quality.image_prompt_optimizer import ImagePromptOptimizer
+from app.utils.metrics import StageMetrics
+from app.utils.tracing import NOOP_SPAN, Span, Tracer, current_span, start_span, use_span
 
 LOGGER = logging.getLogger(__name__)
 
+SPECULATION_WORKERS = 8
+
+# Feedback handed to the pre-emptive optimizer, which runs before any verdict exists.
+SPECULATIVE_EVALUATION: Dict[str, Any] = {
+    "checks": {},
+    "feedback": "Revisa que la respuesta cumpla todos los criterios y el formato solicitado.",
+}
+
+
+class Call:
+    """A model call requested by the orchestration flow.
+
+    The flow is written once as a generator that yields ``Call`` objects and
+    receives their results; :meth:`Orchestrator.handle` runs each call with
+    the blocking method (``run``, ``evaluate``...) and
+    :meth:`Orchestrator.ahandle` awaits its ``a``-prefixed async twin.
+    """
+
+    __slots__ = ("stage", "target", "method", "kwargs")
+
+    def __init__(self, stage: str, target: Any, method: str, **kwargs: Any) -> None:
+        self.stage = stage
+        self.target = target
+        self.method = method
+        self.kwargs = kwargs
+
+
+class Speculation:
+    """Two calls started together where the second may turn out unnecessary.
+
+    Drivers run ``primary`` and ``speculative`` concurrently and send back a
+    :class:`SpeculationResult`. When ``needed(primary_result)`` is false the
+    speculative call is cancelled and ``None`` is sent in its place; if it had
+    already started it cannot be taken back, so the driver still collects it
+    as ``discarded`` for its usage to be accounted.
+    """
+
+    __slots__ = ("stage", "primary", "speculative", "needed")
+
+    def __init__(self, primary: Call, speculative: Call, needed: Callable[[Any], bool]) -> None:
+        self.stage = f"{primary.stage}+{speculative.stage}"
+        self.primary = primary
+        self.speculative = speculative
+        self.needed = needed
+
+
+class SpeculationResult(NamedTuple):
+    """What a driver sends back for a :class:`Speculation`, with each call's own latency."""
+
+    primary: Any
+    speculative: Any
+    discarded: Any = None
+    primary_ms: Optional[float] = None
+    speculative_ms: Optional[float] = None
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+Step = Union[Call, Speculation]
+Flow = Generator[Step, Any, Dict[str, Any]]
+
 
 class Orchestrator:
     def __init__(
@@ -23,6 +97,21 @@ class Orchestrator:
         image_prompt_evaluator: Optional[ImagePromptEvaluator] = None,
         image_prompt_optimizer: Optional[ImagePromptOptimizer] = None,
         max_retries: int = 2,
+        retrieval_scorer: str = "heuristic",
+        retrieval_backend: str = "python",
+        response_cache: Optional[ResponseCache] = None,
+        speculative: bool = False,
+        prechecks: bool = True,
+        self_check: bool = False,
+        self_check_sample_rate: float = 0.1,
+        self_check_min_confidence: float = 0.8,
+        deadline_seconds: Optional[float] = None,
+        retry_round_estimate: float = 4.0,
+        image_cache: Optional[ImageCache] = None,
+        metrics: Optional[StageMetrics] = None,
+        tracer: Optional[Tracer] = None,
+        context_tokens: int = CONTEXT_TOKEN_BUDGET,
+        book_prefix_tokens: int = BOOK_PREFIX_TOKENS,
     ) -> None:
         self.workers = workers
         self.evaluator = evaluator
@@ -30,6 +119,24 @@ class Orchestrator:
         self.image_prompt_evaluator = image_prompt_evaluator
         self.image_prompt_optimizer = image_prompt_optimizer
         self.max_retries = max_retries
+        self.retrieval_scorer = retrieval_scorer
+        self.retrieval_backend = retrieval_backend
+        self.response_cache = response_cache
+        self.speculative = speculative
+        self.prechecks = prechecks
+        self.self_check = self_check
+        self.self_check_sample_rate = self_check_sample_rate
+        self.self_check_min_confidence = self_check_min_confidence
+        self.deadline_seconds = deadline_seconds
+        # Running estimate, per worker, of one optimise + evaluate round in seconds.
+        self.retry_round_estimate = retry_round_estimate
+        self._round_estimates: Dict[str, float] = {}
+        self.image_cache = image_cache
+        self.metrics = metrics
+        self.tracer = tracer
+        self.context_tokens = context_tokens
+        self.book_prefix_tokens = book_prefix_tokens
+        self._speculation_pool: Optional[ThreadPoolExecutor] = None
 
     @staticmethod
     def _resolve_worker_name(mode: str | None) -> str:
@@ -44,6 +151,402 @@ class Orchestrator:
         return mapping.get(mode.lower(), "TutorWorker")
 
     def handle(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        root = self._start_trace(payload, "sync")
+        flow = self._flow(payload)
+        result: Any = None
+        try:
+            with use_span(root):
+                while True:
+                    try:
+                        step = flow.send(result)
+                    except StopIteration as stop:
+                        return self._end_trace(root, stop.value)
+                    try:
+                        result = self._run(step)
+                    except Exception as exc:
+                        self._fail(flow, exc)
+        except BaseException as exc:
+            root.end(error=repr(exc))
+            raise
+
+    async def ahandle(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Async variant of :meth:`handle`; needs workers built on ``AsyncOpenAI``."""
+        root = self._start_trace(payload, "async")
+        flow = self._flow(payload)
+        result: Any = None
+        try:
+            with use_span(root):
+                while True:
+                    try:
+                        step = flow.send(result)
+                    except StopIteration as stop:
+                        return self._end_trace(root, stop.value)
+                    try:
+                        result = await self._arun(step)
+                    except Exception as exc:
+                        self._fail(flow, exc)
+        except BaseException as exc:
+            root.end(error=repr(exc))
+            raise
+
+    def handle_stream(self, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Run :meth:`handle` emitting progress events as they happen.
+
+        Workers that implement ``stream`` send their text as ``token`` events;
+        each evaluator verdict is an ``evaluation`` event and every optimised
+        rewrite a ``replacement`` event. The last event is ``done`` with the
+        same result :meth:`handle` returns. Self-checked worker calls answer
+        in JSON, so they run whole and produce no ``token`` events.
+        """
+        root = self._start_trace(payload, "stream")
+        try:
+            yield from self._stream_events(payload, root)
+        except BaseException as exc:
+            root.end(error=repr(exc))
+            raise
+
+    def _stream_events(self, payload: Dict[str, Any], root: Span) -> Iterator[Dict[str, Any]]:
+        flow = self._flow(payload)
+        result: Any = None
+        retry = 0
+        while True:
+            # The current span is only set around ``send``: this generator is
+            # suspended between events and must not leak it to the caller.
+            try:
+                with use_span(root):
+                    step = flow.send(result)
+            except StopIteration as stop:
+                yield {"event": "done", "data": self._end_trace(root, stop.value)}
+                return
+
+            if (
+                isinstance(step, Call)
+                and step.method == "run"
+                and hasattr(step.target, "stream")
+                and not step.kwargs.get("self_check")
+            ):
+                stream = step.target.stream(**step.kwargs)
+                while True:
+                    try:
+                        token = next(stream)
+                    except StopIteration as stop:
+                        result = stop.value
+                        break
+                    except Exception as exc:
+                        self._fail(flow, exc)
+                    yield {"event": "token", "data": {"text": token}}
+                continue
+
+            try:
+                with use_span(root):
+                    result = self._run(step)
+            except Exception as exc:
+                self._fail(flow, exc)
+            if isinstance(step, Speculation):
+                outcomes = [(step.primary.stage, result.primary), (step.speculative.stage, result.speculative)]
+            else:
+                outcomes = [(step.stage, result)]
+            for stage, outcome in outcomes:
+                if outcome is None:
+                    continue
+                if stage == "evaluation":
+                    yield {
+                        "event": "evaluation",
+                        "data": {
+                            "checks": outcome.get("checks", {}),
+                            "passed": outcome.get("passed", False),
+                            "feedback": outcome.get("feedback", ""),
+                            "retry": retry,
+                        },
+                    }
+                elif stage == "optimizer":
+                    retry += 1
+                    yield {
+                        "event": "replacement",
+                        "data": {"content": outcome.get("content", ""), "retry": retry},
+                    }
+
+    @staticmethod
+    def _fail(flow: Flow, exc: Exception) -> None:
+        """Raise ``exc`` inside the flow, so the failing stage closes its span, then out of it."""
+        flow.throw(exc)
+        raise exc
+
+    def _start_trace(self, payload: Dict[str, Any], driver: str) -> Span:
+        if self.tracer is None:
+            return NOOP_SPAN
+        return self.tracer.start_trace(
+            "orchestrator.request",
+            mode=payload.get("mode") or "explicar",
+            driver=driver,
+            book_key=payload.get("book_key"),
+        )
+
+    @staticmethod
+    def _end_trace(root: Span, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Close the root span; kept traces get their id in ``trace.trace_id``."""
+        trace = result.get("trace") or {}
+        root.set(worker=trace.get("worker"), retries=trace.get("retries"))
+        root.end()
+        if not root.recording or not root.attributes.get("sampled"):
+            return result
+        return {**result, "trace": {**trace, "trace_id": root.trace_id}}
+
+    def _run(self, step: Step) -> Any:
+        if isinstance(step, Speculation):
+            if self._speculation_pool is None:
+                self._speculation_pool = ThreadPoolExecutor(
+                    max_workers=SPECULATION_WORKERS, thread_name_prefix="speculation"
+                )
+            future = self._speculation_pool.submit(self._run_timed, step.speculative)
+            try:
+                primary, primary_ms = self._run_timed(step.primary)
+            except BaseException:
+                future.cancel()
+                raise
+            if not step.needed(primary):
+                if future.cancel():
+                    return SpeculationResult(primary, None, primary_ms=primary_ms)
+                # A running thread cannot be interrupted and its tokens are
+                # billed anyway: wait for it so its usage is accounted.
+                try:
+                    discarded, speculative_ms = future.result()
+                except Exception:
+                    LOGGER.warning("Discarded speculative %s call failed", step.speculative.stage, exc_info=True)
+                    discarded, speculative_ms = None, None
+                return SpeculationResult(primary, None, discarded, primary_ms, speculative_ms)
+            speculative, speculative_ms = future.result()
+            return SpeculationResult(primary, speculative, None, primary_ms, speculative_ms)
+        return getattr(step.target, step.method)(**step.kwargs)
+
+    def _run_timed(self, call: Call) -> Tuple[Any, float]:
+        started = time.perf_counter()
+        result = self._run(call)
+        return result, _elapsed_ms(started)
+
+    async def _arun(self, step: Step) -> Any:
+        if isinstance(step, Speculation):
+            task = asyncio.ensure_future(self._arun_timed(step.speculative))
+            try:
+                primary, primary_ms = await self._arun_timed(step.primary)
+            except BaseException:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            if not step.needed(primary):
+                # Cancelling aborts the request; a call that already finished
+                # is kept as discarded so its usage is accounted.
+                task.cancel()
+                (outcome,) = await asyncio.gather(task, return_exceptions=True)
+                if isinstance(outcome, Exception):
+                    LOGGER.warning("Discarded speculative %s call failed: %r", step.speculative.stage, outcome)
+                discarded, speculative_ms = (None, None) if isinstance(outcome, BaseException) else outcome
+                return SpeculationResult(primary, None, discarded, primary_ms, speculative_ms)
+            speculative, speculative_ms = await task
+            return SpeculationResult(primary, speculative, None, primary_ms, speculative_ms)
+        return await getattr(step.target, f"a{step.method}")(**step.kwargs)
+
+    async def _arun_timed(self, call: Call) -> Tuple[Any, float]:
+        started = time.perf_counter()
+        result = await self._arun(call)
+        return result, _elapsed_ms(started)
+
+    @staticmethod
+    def _cached_image_result(
+        entry: Dict[str, Any],
+        fragment: str,
+        usage_events: List[Dict[str, Any]],
+        trace: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        if trace is None:
+            trace = {"worker": "ImageWorker", "checks": {}, "retries": 0, "feedback": "", "timings": []}
+        variants = [
+            {
+                "data": None,
+                "id": variant["image_id"],
+                "bytes": variant.get("bytes"),
+                "mime_type": entry.get("mime_type", "image/png"),
+                "width": entry.get("width"),
+                "height": entry.get("height"),
+            }
+            for variant in entry.get("variants") or [entry]
+        ]
+        return {
+            "image": variants[0],
+            "variants": variants,
+            "prompt": entry.get("prompt"),
+            "revised_prompt": entry.get("revised_prompt"),
+            "trace": {**trace, "cached": True},
+            "fragment": fragment,
+            "usage": usage_events,
+        }
+
+    @staticmethod
+    def _passed_checks(evaluation: Dict[str, Any]) -> int:
+        return sum(1 for passed in evaluation.get("checks", {}).values() if passed)
+
+    def _record_round(self, worker_name: str, seconds: float) -> None:
+        previous = self._round_estimates.get(worker_name)
+        self._round_estimates[worker_name] = seconds if previous is None else 0.7 * previous + 0.3 * seconds
+
+    def _precheck(
+        self,
+        worker_name: str,
+        candidate: str,
+        context: Dict[str, Any],
+        retry: int,
+        log: List[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """Run the local pre-checks and log their decision for the trace."""
+        if not self.prechecks:
+            return {"checks": {}, "verdict": "undecided", "feedback": ""}
+        precheck = run_prechecks(worker_name, candidate, context)
+        log.append({"retry": retry, "verdict": precheck["verdict"], "checks": precheck["checks"]})
+        if precheck["verdict"] == "fail":
+            LOGGER.info("Pre-checks failed for %s, skipping the evaluator call", worker_name)
+        return precheck
+
+    def _self_evaluation(
+        self, worker_name: str, attempt: Dict[str, Any]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Turn the worker's own verdict into an evaluation when it can be trusted.
+
+        Returns ``(evaluation, record)``; the evaluation is ``None`` when the
+        external evaluator must run because the verdict is missing, not
+        confident enough or the request was sampled for an audit.
+        """
+        if not self.self_check:
+            return None, None
+        verdict = attempt.get("self_check")
+        if not verdict:
+            return None, {"accepted": False, "reason": "unparsed"}
+        record = {"accepted": False, "confidence": verdict["confidence"]}
+        if verdict["confidence"] < self.self_check_min_confidence:
+            return None, {**record, "reason": "low_confidence"}
+        if random.random() < self.self_check_sample_rate:
+            return None, {**record, "reason": "sampled"}
+
+        checklist = CHECKLISTS.get(worker_name, [])
+        checks = {item: verdict["checks"].get(item, False) for item in checklist}
+        evaluation = {
+            "checks": checks,
+            "feedback": verdict.get("feedback", ""),
+            "passed": all(checks.values()) if checklist else True,
+            "usage": None,
+        }
+        return evaluation, {**record, "accepted": True, "reason": "confident"}
+
+    @staticmethod
+    def _prompt_chars(step: Step) -> int:
+        call = step.primary if isinstance(step, Speculation) else step
+        size = 0
+        for value in call.kwargs.values():
+            if isinstance(value, str):
+                size += len(value)
+            elif isinstance(value, dict) and isinstance(value.get("context"), str):
+                size += len(value["context"])
+        return size
+
+    @classmethod
+    def _timed(cls, step: Step, timings: List[Dict[str, Any]], retry: int) -> Generator[Step, Any, Any]:
+        """Yield ``step``, record how long the driver took to resolve it and trace it as a span."""
+        span = start_span(step.stage, retry=retry, prompt_chars=cls._prompt_chars(step))
+        started = time.perf_counter()
+        try:
+            result = yield step
+        except BaseException as exc:
+            timings.append({"stage": step.stage, "retry": retry, "ms": _elapsed_ms(started), "error": repr(exc)})
+            span.end(error=repr(exc))
+            raise
+        timing = {"stage": step.stage, "retry": retry, "ms": _elapsed_ms(started)}
+        if isinstance(step, Speculation):
+            timing["calls"] = {step.primary.stage: result.primary_ms, step.speculative.stage: result.speculative_ms}
+        timings.append(timing)
+        primary = result.primary if isinstance(step, Speculation) else result
+        usage = (primary.get("usage") if isinstance(primary, dict) else None) or {}
+        span.set(
+            model=usage.get("model"),
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            cached_tokens=usage.get("cached_tokens"),
+        )
+        if isinstance(step, Speculation):
+            speculative = result.speculative if result.speculative is not None else result.discarded
+            speculative_usage = (speculative.get("usage") if isinstance(speculative, dict) else None) or {}
+            span.set(
+                speculation_used=result.speculative is not None,
+                speculation_discarded=result.discarded is not None,
+                speculative_prompt_tokens=speculative_usage.get("prompt_tokens"),
+                speculative_completion_tokens=speculative_usage.get("completion_tokens"),
+            )
+        span.end()
+        return result
+
+    def retrieve(
+        self,
+        *,
+        book_text: str,
+        query: str,
+        book_key: Any,
+        max_tokens: int,
+        prefix_tokens: int = 0,
+    ) -> Dict[str, Any]:
+        """Build the prompt context; the flow yields it as a ``retrieval`` call.
+
+        With ``prefix_tokens`` the context also carries ``book_opening``, the
+        first ``prefix_tokens`` tokens of the book. It does not depend on the
+        query, so the text workers place it in the cacheable prompt prefix.
+        """
+        with start_span(
+            "retrieval", scorer=self.retrieval_scorer, backend=self.retrieval_backend, max_tokens=max_tokens
+        ) as span:
+            context = build_context(
+                book_text,
+                query,
+                max_tokens=max_tokens,
+                book_key=book_key,
+                scorer=self.retrieval_scorer,
+                backend=self.retrieval_backend,
+            )
+            if prefix_tokens:
+                # An empty query selects the opening; it is memoised like any other context.
+                context["book_opening"] = build_context(
+                    book_text,
+                    None,
+                    max_tokens=prefix_tokens,
+                    book_key=book_key,
+                    scorer=self.retrieval_scorer,
+                    backend=self.retrieval_backend,
+                )["context"]
+            span.set(
+                context_chars=len(context.get("context", "")),
+                opening_chars=len(context.get("book_opening", "")),
+            )
+        return context
+
+    async def aretrieve(self, **kwargs: Any) -> Dict[str, Any]:
+        """Async variant of :meth:`retrieve`, run in a thread.
+
+        Indexing a book the first time it is queried and scoring its chunks
+        are CPU-bound and would otherwise block every request on the loop.
+        """
+        return await asyncio.to_thread(self.retrieve, **kwargs)
+
+    def _usage_event(
+        self,
+        usage: Dict[str, Any],
+        stage: str,
+        retry: int,
+        ms: Optional[float],
+        **extra: Any,
+    ) -> Dict[str, Any]:
+        """Usage of one call with its latency ``ms``, also fed to the metrics."""
+        event = {**usage, "stage": stage, "retry": retry, "ms": ms, **extra}
+        if self.metrics is not None:
+            self.metrics.observe(event)
+        return event
+
+    def _flow(self, payload: Dict[str, Any]) -> Flow:
         mode = payload.get("mode")
         worker_name = self._resolve_worker_name(mode)
         worker = self.workers.get(worker_name)
@@ -51,7 +554,24 @@ class Orchestrator:
             raise ValueError(f"Worker no configurado para modo {mode}")
 
         if worker_name == "ImageWorker":
-            return self._handle_image(worker, payload)
+            return (yield from self._image_flow(worker, payload))
+
+        # The clock starts when the route received the request, before the book was loaded.
+        started = payload.get("received_at") or time.perf_counter()
+        budgets = [float(value) for value in (payload.get("deadline_seconds"), self.deadline_seconds) if value]
+        # A client may ask for less time than the server allows, never for more.
+        budget = min(budgets) if budgets else None
+        deadline = started + budget if budget else None
+
+        cache_key = self.response_cache.key(worker_name, payload) if self.response_cache else None
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                LOGGER.info("Response cache hit for %s", worker_name)
+                current_span().set(cache_hit="response")
+                # Timings of the run that filled the cache say nothing about this request.
+                cached.get("trace", {})["timings"] = []
+                return cached
 
         message = payload.get("message", "")
         age = int(payload.get("age", 9))
@@ -60,49 +580,126 @@ class Orchestrator:
             "title": payload.get("book_title", "Libro"),
         }
 
-        context = build_context(book_text, message if message else metadata.get("title"))
+        context = yield Call(
+            "retrieval",
+            self,
+            "retrieve",
+            book_text=book_text,
+            query=message if message else metadata.get("title"),
+            book_key=payload.get("book_key"),
+            max_tokens=self.context_tokens,
+            prefix_tokens=self.book_prefix_tokens,
+        )
         LOGGER.info("Orchestrator routing to %s", worker_name)
 
-        attempt = worker.run(message=message, age=age, context=context, metadata=metadata)
+        timings: List[Dict[str, Any]] = []
+        worker_kwargs: Dict[str, Any] = {"message": message, "age": age, "context": context, "metadata": metadata}
+        if self.self_check:
+            worker_kwargs["self_check"] = True
+        attempt = yield from self._timed(Call(worker_name, worker, "run", **worker_kwargs), timings, 0)
         candidate = attempt.get("content", "")
         usage_events: List[Dict[str, Any]] = []
 
         if attempt.get("usage"):
-            usage_events.append(
-                {
-                    **attempt["usage"],
-                    "stage": worker_name,
-                    "retry": 0,
-                }
-            )
+            usage_events.append(self._usage_event(attempt["usage"], worker_name, 0, timings[-1]["ms"]))
 
-        evaluation = self.evaluator.evaluate(
+        evaluate_call = Call(
+            "evaluation",
+            self.evaluator,
+            "evaluate",
             worker_name=worker_name,
             candidate=candidate,
             context=context,
         )
+        precheck_log: List[Dict[str, Any]] = []
+        precheck = self._precheck(worker_name, candidate, context, 0, precheck_log)
+        self_evaluation, self_check_record = self._self_evaluation(worker_name, attempt)
+        speculative_optimisation: Any = None
+        discarded_optimisation: Any = None
+        optimisation_ms: Optional[float] = None
+        speculated = (
+            self.speculative
+            and self.max_retries > 0
+            and precheck["verdict"] != "fail"
+            and self_evaluation is None
+        )
+        if precheck["verdict"] == "fail":
+            evaluation = failed_evaluation(precheck)
+        elif self_evaluation is not None:
+            evaluation = self_evaluation
+        elif speculated:
+            # The rewrite starts before the verdict; it is only kept when the
+            # evaluation fails, trading its tokens for one less round trip.
+            speculation = yield from self._timed(
+                Speculation(
+                    evaluate_call,
+                    Call(
+                        "optimizer",
+                        self.optimizer,
+                        "optimise",
+                        worker_name=worker_name,
+                        previous_answer=candidate,
+                        evaluation=SPECULATIVE_EVALUATION,
+                        context=context,
+                        age=age,
+                        message=message,
+                        metadata=metadata,
+                    ),
+                    needed=lambda verdict: not verdict.get("passed", False),
+                ),
+                timings,
+                0,
+            )
+            evaluation, speculative_optimisation, discarded_optimisation, evaluation_ms, optimisation_ms = speculation
+        else:
+            evaluation = yield from self._timed(evaluate_call, timings, 0)
+            evaluation_ms = timings[-1]["ms"]
+        evaluation = apply_prechecks(worker_name, evaluation, precheck)
 
         if evaluation.get("usage"):
+            usage_events.append(self._usage_event(evaluation["usage"], "evaluation", 0, evaluation_ms))
+        if discarded_optimisation and discarded_optimisation.get("usage"):
+            # The evaluation passed after the rewrite had started: paid for, never used.
             usage_events.append(
-                {
-                    **evaluation["usage"],
-                    "stage": "evaluation",
-                    "retry": 0,
-                }
+                self._usage_event(
+                    discarded_optimisation["usage"], "optimizer", 1, optimisation_ms, speculative=True, discarded=True
+                )
             )
 
+        best = (self._passed_checks(evaluation), candidate, evaluation, 0)
+        stopped_by_deadline = False
         retries = 0
         while not evaluation.get("passed", False) and retries < self.max_retries:
+            estimate = self._round_estimates.get(worker_name, self.retry_round_estimate)
+            if deadline is not None and deadline - time.perf_counter() < estimate:
+                LOGGER.info(
+                    "Deadline leaves no room for another round on %s (estimate %.2fs)", worker_name, estimate
+                )
+                stopped_by_deadline = True
+                break
+            round_started = time.perf_counter()
             LOGGER.info("Optimizer triggered for %s (retry %s)", worker_name, retries + 1)
-            optimisation = self.optimizer.optimise(
-                worker_name=worker_name,
-                previous_answer=candidate,
-                evaluation=evaluation,
-                context=context,
-                age=age,
-                message=message,
-                metadata=metadata,
-            )
+            speculative = speculative_optimisation is not None
+            if speculative:
+                optimisation, speculative_optimisation = speculative_optimisation, None
+            else:
+                optimisation = yield from self._timed(
+                    Call(
+                        "optimizer",
+                        self.optimizer,
+                        "optimise",
+                        worker_name=worker_name,
+                        previous_answer=candidate,
+                        evaluation=evaluation,
+                        context=context,
+                        age=age,
+                        message=message,
+                        metadata=metadata,
+                    ),
+                    timings,
+                    retries + 1,
+                )
+                optimisation_ms = timings[-1]["ms"]
             if isinstance(optimisation, dict):
                 candidate = optimisation.get("content", "")
                 optimisation_usage = optimisation.get("usage")
@@ -112,42 +709,73 @@ class Orchestrator:
 
             if optimisation_usage:
                 usage_events.append(
-                    {
-                        **optimisation_usage,
-                        "stage": "optimizer",
-                        "retry": retries + 1,
-                    }
+                    self._usage_event(
+                        optimisation_usage,
+                        "optimizer",
+                        retries + 1,
+                        optimisation_ms,
+                        **({"speculative": True} if speculative else {}),
+                    )
                 )
-            evaluation = self.evaluator.evaluate(
-                worker_name=worker_name,
-                candidate=candidate,
-                context=context,
-            )
+            precheck = self._precheck(worker_name, candidate, context, retries + 1, precheck_log)
+            if precheck["verdict"] == "fail":
+                evaluation = failed_evaluation(precheck)
+            else:
+                evaluation = yield from self._timed(
+                    Call(
+                        "evaluation",
+                        self.evaluator,
+                        "evaluate",
+                        worker_name=worker_name,
+                        candidate=candidate,
+                        context=context,
+                    ),
+                    timings,
+                    retries + 1,
+                )
+                evaluation = apply_prechecks(worker_name, evaluation, precheck)
             if evaluation.get("usage"):
                 usage_events.append(
-                    {
-                        **evaluation["usage"],
-                        "stage": "evaluation",
-                        "retry": retries + 1,
-                    }
+                    self._usage_event(evaluation["usage"], "evaluation", retries + 1, timings[-1]["ms"])
                 )
             retries += 1
-
+            if not speculative and precheck["verdict"] != "fail":
+                # Only full rounds are representative: a reused speculative
+                # rewrite or a skipped evaluator call would drag the estimate down.
+                self._record_round(worker_name, time.perf_counter() - round_started)
+            # Ties go to the newer candidate, which already addressed earlier feedback.
+            if evaluation.get("passed", False) or self._passed_checks(evaluation) >= best[0]:
+                best = (self._passed_checks(evaluation), candidate, evaluation, retries)
+
+        _, candidate, evaluation, selected_retry = best
         trace = {
             "worker": worker_name,
             "checks": evaluation.get("checks", {}),
             "retries": retries,
+            "selected_retry": selected_retry,
+            "deadline": {
+                "budget_seconds": budget,
+                "elapsed_seconds": round(time.perf_counter() - started, 3),
+                "stopped_early": stopped_by_deadline,
+            },
             "feedback": evaluation.get("feedback", ""),
+            "speculative": speculated,
+            "prechecks": precheck_log,
+            "self_check": self_check_record,
+            "timings": timings,
         }
 
-        return {
+        result = {
             "content": candidate,
             "trace": trace,
             "anchor": attempt.get("anchor", ""),
             "usage": usage_events,
         }
+        if cache_key is not None and evaluation.get("passed", False):
+            self.response_cache.set(cache_key, result)
+        return result
 
-    def _handle_image(self, worker: Any, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def _image_flow(self, worker: Any, payload: Dict[str, Any]) -> Flow:
         if not self.image_prompt_evaluator or not self.image_prompt_optimizer:
             raise RuntimeError("El evaluador/optimizador de prompts de imagen no está configurado.")
 
@@ -161,16 +789,46 @@ class Orchestrator:
         metadata = {
             "title": payload.get("book_title", "Libro"),
         }
+        generation_options: Dict[str, Any] = {
+            "n": max(1, int(payload.get("variants") or 1)),
+            "size": payload.get("size") or DEFAULT_IMAGE_SIZE,
+            "quality": payload.get("quality"),
+        }
 
-        context = build_context(book_text, raw_prompt or metadata.get("title"))
+        context = yield Call(
+            "retrieval",
+            self,
+            "retrieve",
+            book_text=book_text,
+            query=raw_prompt or metadata.get("title"),
+            book_key=payload.get("book_key"),
+            max_tokens=IMAGE_FRAGMENT_TOKENS,
+        )
         contextual_fragment = context.get("context", "").strip()
 
-        fragments: List[str] = []
-        if provided_fragment:
-            fragments.append(provided_fragment)
-        if contextual_fragment and contextual_fragment not in provided_fragment:
-            fragments.append(contextual_fragment)
-        combined_fragment = "\n\n".join(fragments)[:1200]
+        # The provided fragment usually comes from an earlier retrieval over
+        # the same book: sentences it shares with the new one are sent once.
+        image_fragment = pack_texts([provided_fragment, contextual_fragment], IMAGE_FRAGMENT_TOKENS)
+
+        request_key = None
+        if self.image_cache is not None:
+            # Same prompt, book fragment, age and model as an earlier request:
+            # both the prompt loop and the generation can be skipped.
+            request_key = self.image_cache.key(
+                worker.generation_request(
+                    prompt=raw_prompt,
+                    age=age,
+                    fragment=image_fragment,
+                    metadata=metadata,
+                    context=context,
+                    **generation_options,
+                )
+            )
+            cached = self.image_cache.get(request_key)
+            if cached is not None:
+                LOGGER.info("Image cache hit before the prompt loop")
+                current_span().set(cache_hit="image_request")
+                return self._cached_image_result(cached, image_fragment, [])
 
         usage_events: List[Dict[str, Any]] = []
         retries = 0
@@ -178,33 +836,43 @@ class Orchestrator:
         last_evaluation: Dict[str, Any] = {}
         optimizer_notes: List[str] = []
 
+        timings: List[Dict[str, Any]] = []
+
         while True:
-            evaluation = self.image_prompt_evaluator.evaluate(
-                prompt=candidate_prompt,
-                age=age,
-                metadata=metadata,
-                fragment=combined_fragment or contextual_fragment,
+            evaluation = yield from self._timed(
+                Call(
+                    "image_prompt_evaluator",
+                    self.image_prompt_evaluator,
+                    "evaluate",
+                    prompt=candidate_prompt,
+                    age=age,
+                    metadata=metadata,
+                    fragment=image_fragment,
+                ),
+                timings,
+                retries,
             )
             last_evaluation = evaluation
 
             if evaluation.get("usage"):
-                usage_events.append(
-                    {
-                        **evaluation["usage"],
-                        "stage": "image_prompt_evaluator",
-                        "retry": retries,
-                    }
-                )
+                usage_events.append(self._usage_event(evaluation["usage"], "image_prompt_evaluator", retries, timings[-1]["ms"]))
 
             if evaluation.get("passed", False) or retries >= self.max_retries:
                 break
 
-            optimisation = self.image_prompt_optimizer.optimise(
-                prompt=candidate_prompt,
-                age=age,
-                metadata=metadata,
-                fragment=combined_fragment or contextual_fragment,
-                evaluation=evaluation,
+            optimisation = yield from self._timed(
+                Call(
+                    "image_prompt_optimizer",
+                    self.image_prompt_optimizer,
+                    "optimise",
+                    prompt=candidate_prompt,
+                    age=age,
+                    metadata=metadata,
+                    fragment=image_fragment,
+                    evaluation=evaluation,
+                ),
+                timings,
+                retries + 1,
             )
             candidate_prompt = optimisation.get("prompt", candidate_prompt)
             notes = optimisation.get("notes")
@@ -214,32 +882,56 @@ class Orchestrator:
             optimisation_usage = optimisation.get("usage")
             if optimisation_usage:
                 usage_events.append(
-                    {
-                        **optimisation_usage,
-                        "stage": "image_prompt_optimizer",
-                        "retry": retries + 1,
-                    }
+                    self._usage_event(optimisation_usage, "image_prompt_optimizer", retries + 1, timings[-1]["ms"])
                 )
 
             retries += 1
 
-        worker_result = worker.run(
-            prompt=candidate_prompt,
-            age=age,
-            fragment=combined_fragment or contextual_fragment,
-            metadata=metadata,
-            context=context,
+        final_key = None
+        if self.image_cache is not None:
+            final_key = self.image_cache.key(
+                worker.generation_request(
+                    prompt=candidate_prompt,
+                    age=age,
+                    fragment=image_fragment,
+                    metadata=metadata,
+                    context=context,
+                    **generation_options,
+                )
+            )
+            cached = self.image_cache.get(final_key)
+            if cached is not None:
+                LOGGER.info("Image cache hit for the optimised prompt")
+                current_span().set(cache_hit="image_prompt")
+                self.image_cache.set(request_key, cached)
+                trace = {
+                    "worker": "ImageWorker",
+                    "checks": last_evaluation.get("checks", {}),
+                    "retries": retries,
+                    "feedback": last_evaluation.get("feedback", ""),
+                    "timings": timings,
+                }
+                return self._cached_image_result(cached, image_fragment, usage_events, trace)
+
+        worker_result = yield from self._timed(
+            Call(
+                "image_worker",
+                worker,
+                "run",
+                prompt=candidate_prompt,
+                age=age,
+                fragment=image_fragment,
+                metadata=metadata,
+                context=context,
+                **generation_options,
+            ),
+            timings,
+            retries,
         )
 
         worker_usage = worker_result.get("usage")
         if worker_usage:
-            usage_events.append(
-                {
-                    **worker_usage,
-                    "stage": "image_worker",
-                    "retry": retries,
-                }
-            )
+            usage_events.append(self._usage_event(worker_usage, "image_worker", retries, timings[-1]["ms"]))
 
         feedback_notes = [last_evaluation.get("feedback", "").strip()]
         feedback_notes.extend(optimizer_notes)
@@ -250,19 +942,45 @@ class Orchestrator:
             "checks": last_evaluation.get("checks", {}),
             "retries": retries,
             "feedback": feedback,
+            "timings": timings,
         }
 
+        image = {
+            "data": worker_result.get("image_b64"),
+            "mime_type": worker_result.get("mime_type", "image/png"),
+            "width": worker_result.get("width"),
+            "height": worker_result.get("height"),
+        }
+        variants = [
+            {**image, "data": variant["image_b64"]}
+            for variant in worker_result.get("variants") or [{"image_b64": image["data"]}]
+        ]
+        if self.image_cache is not None and image["data"]:
+            # Decoded once: callers use the stored ids instead of the base64 payloads.
+            for variant in variants:
+                stored = self.image_cache.store.save_b64(variant["data"], variant["mime_type"])
+                variant.update(data=None, id=stored["id"], bytes=stored["bytes"])
+            image = variants[0]
+            entry = {
+                "image_id": image["id"],
+                "bytes": image["bytes"],
+                "mime_type": image["mime_type"],
+                "width": image["width"],
+                "height": image["height"],
+                "prompt": candidate_prompt,
+                "revised_prompt": worker_result.get("revised_prompt"),
+                "variants": [{"image_id": variant["id"], "bytes": variant["bytes"]} for variant in variants],
+            }
+            self.image_cache.set(final_key, entry)
+            self.image_cache.set(request_key, entry)
+
         payload_out = {
-            "image": {
-                "data": worker_result.get("image_b64"),
-                "mime_type": worker_result.get("mime_type", "image/png"),
-                "width": worker_result.get("width"),
-                "height": worker_result.get("height"),
-            },
+            "image": image,
+            "variants": variants,
             "prompt": candidate_prompt,
             "revised_prompt": worker_result.get("revised_prompt"),
             "trace": trace,
-            "fragment": combined_fragment or contextual_fragment,
+            "fragment": image_fragment,
             "usage": usage_events,
         }
 
@@ -3,15 +3,16 @@ from __future__ import annotations
 import json
 from typing import Any, Dict
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from app.nlp.compaction import compact_fragment
 from app.utils.usage import extract_usage
 
 
 CHECKLISTS = {
     "TutorWorker": ["anchored", "clarity", "structure", "safety"],
     "VocabWorker": ["anchored", "clarity", "structure", "safety"],
-    "EvalWorker": ["variety", "distractores", "feedback", "difficulty"],
+    "EvalWorker": ["variety", "distractores", "feedback", "difficulty", "structure"],
 }
 
 EVALUATOR_PROMPT = (
@@ -21,8 +22,10 @@ EVALUATOR_PROMPT = (
 
 
 class ResponseEvaluator:
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI, *, compact: bool = False):
         self.client = client
+        # Send only the fragment sentences the candidate quotes or paraphrases.
+        self.compact = compact
 
     def evaluate(
         self,
@@ -30,6 +33,28 @@ class ResponseEvaluator:
         worker_name: str,
         candidate: str,
         context: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        request = self._request(worker_name=worker_name, candidate=candidate, context=context)
+        completion = self.client.chat.completions.create(**request)
+        return self._result(completion, worker_name)
+
+    async def aevaluate(
+        self,
+        *,
+        worker_name: str,
+        candidate: str,
+        context: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        request = self._request(worker_name=worker_name, candidate=candidate, context=context)
+        completion = await self.client.chat.completions.create(**request)
+        return self._result(completion, worker_name)
+
+    def _request(
+        self,
+        *,
+        worker_name: str,
+        candidate: str,
+        context: Dict[str, Any],
     ) -> Dict[str, Any]:
         checklist = CHECKLISTS.get(worker_name, [])
         checklist_str = ", ".join(checklist)
@@ -39,6 +64,8 @@ class ResponseEvaluator:
         )
 
         fragment = context.get("context", "")
+        if self.compact:
+            fragment = compact_fragment(fragment, candidate)
         triple = '"""'
         checklist_entries = ", ".join(f'"{item}": true/false' for item in checklist)
         user_prompt = (
@@ -53,16 +80,19 @@ class ResponseEvaluator:
             "}"
         )
 
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
-            temperature=0.0,
-            max_tokens=260,
-        )
+            "temperature": 0.0,
+            "max_tokens": 260,
+        }
 
+    @staticmethod
+    def _result(completion: Any, worker_name: str) -> Dict[str, Any]:
+        checklist = CHECKLISTS.get(worker_name, [])
         raw = completion.choices[0].message.content.strip()
         usage = extract_usage(completion)
         try:
@@ -4,8 +4,9 @@ from __future__ import annotations
 import json
 from typing import Any, Dict
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from app.nlp.tokens import IMAGE_PROMPT_FRAGMENT_TOKENS, truncate_to_tokens
 from app.utils.usage import extract_usage
 
 IMAGE_CHECKLIST = ["clarity", "safety", "coherence"]
@@ -18,7 +19,7 @@ SYSTEM_PROMPT = (
 
 
 class ImagePromptEvaluator:
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI):
         self.client = client
 
     def evaluate(
@@ -28,13 +29,37 @@ class ImagePromptEvaluator:
         age: int,
         metadata: Dict[str, Any],
         fragment: str,
+    ) -> Dict[str, Any]:
+        request = self._request(prompt=prompt, age=age, metadata=metadata, fragment=fragment)
+        completion = self.client.chat.completions.create(**request)
+        return self._result(completion)
+
+    async def aevaluate(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        metadata: Dict[str, Any],
+        fragment: str,
+    ) -> Dict[str, Any]:
+        request = self._request(prompt=prompt, age=age, metadata=metadata, fragment=fragment)
+        completion = await self.client.chat.completions.create(**request)
+        return self._result(completion)
+
+    def _request(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        metadata: Dict[str, Any],
+        fragment: str,
     ) -> Dict[str, Any]:
         title = metadata.get("title", "Libro")
         triple = '"""'
         user_prompt = (
             f"Libro: {title}\n"
             f"Edad objetivo: {age} años\n"
-            f"Fragmento de referencia:\n{triple}{fragment.strip()[:600]}{triple}\n\n"
+            f"Fragmento de referencia:\n{triple}{truncate_to_tokens(fragment.strip(), IMAGE_PROMPT_FRAGMENT_TOKENS)}{triple}\n\n"
             f"Prompt propuesto:\n{triple}{prompt.strip()}{triple}\n\n"
             "Valida los criterios claridad, safety y coherence. Si alguna dimensión es dudosa o incompleta, márcala como false.\n"
             "Devuelve un JSON con la forma:\n"
@@ -44,16 +69,18 @@ class ImagePromptEvaluator:
             "}"
         )
 
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": [
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
-            temperature=0.0,
-            max_tokens=200,
-        )
+            "temperature": 0.0,
+            "max_tokens": 200,
+        }
 
+    @staticmethod
+    def _result(completion: Any) -> Dict[str, Any]:
         usage = extract_usage(completion)
         raw = completion.choices[0].message.content.strip()
 
@@ -4,8 +4,9 @@ from __future__ import annotations
 import json
 from typing import Any, Dict
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from app.nlp.tokens import IMAGE_PROMPT_FRAGMENT_TOKENS, truncate_to_tokens
 from app.utils.usage import extract_usage
 
 SYSTEM_PROMPT = (
@@ -17,7 +18,7 @@ SYSTEM_PROMPT = (
 
 
 class ImagePromptOptimizer:
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI):
         self.client = client
 
     def optimise(
@@ -28,6 +29,36 @@ class ImagePromptOptimizer:
         metadata: Dict[str, Any],
         fragment: str,
         evaluation: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        request = self._request(
+            prompt=prompt, age=age, metadata=metadata, fragment=fragment, evaluation=evaluation
+        )
+        completion = self.client.chat.completions.create(**request)
+        return self._result(completion, prompt)
+
+    async def aoptimise(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        metadata: Dict[str, Any],
+        fragment: str,
+        evaluation: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        request = self._request(
+            prompt=prompt, age=age, metadata=metadata, fragment=fragment, evaluation=evaluation
+        )
+        completion = await self.client.chat.completions.create(**request)
+        return self._result(completion, prompt)
+
+    def _request(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        metadata: Dict[str, Any],
+        fragment: str,
+        evaluation: Dict[str, Any],
     ) -> Dict[str, Any]:
         title = metadata.get("title", "Libro")
         failed = [name for name, ok in (evaluation.get("checks") or {}).items() if not ok]
@@ -36,7 +67,7 @@ class ImagePromptOptimizer:
         user_prompt = (
             f"Libro: {title}\n"
             f"Edad objetivo: {age} años\n"
-            f"Fragmento de referencia:\n{triple}{fragment.strip()[:600]}{triple}\n\n"
+            f"Fragmento de referencia:\n{triple}{truncate_to_tokens(fragment.strip(), IMAGE_PROMPT_FRAGMENT_TOKENS)}{triple}\n\n"
             f"Prompt previo:\n{triple}{prompt.strip()}{triple}\n\n"
             f"Criterios a corregir: {', '.join(failed) if failed else 'ninguno explícito'}\n"
             f"Comentarios del evaluador: {guidance or 'sin comentarios'}\n\n"
@@ -47,16 +78,18 @@ class ImagePromptOptimizer:
             "}"
         )
 
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": [
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt},
             ],
-            temperature=0.3,
-            max_tokens=220,
-        )
+            "temperature": 0.3,
+            "max_tokens": 220,
+        }
 
+    @staticmethod
+    def _result(completion: Any, prompt: str) -> Dict[str, Any]:
         usage = extract_usage(completion)
         raw = completion.choices[0].message.content.strip()
 
@@ -2,8 +2,9 @@ from __future__ import annotations
 
 from typing import Any, Dict
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from app.nlp.compaction import compact_fragment
 from app.utils.usage import extract_usage
 
 OPTIMIZER_PROMPT = (
@@ -13,8 +14,9 @@ OPTIMIZER_PROMPT = (
 
 
 class ResponseOptimizer:
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI, *, compact: bool = False):
         self.client = client
+        self.compact = compact
 
     def optimise(
         self,
@@ -26,7 +28,53 @@ class ResponseOptimizer:
         age: int,
         message: str,
         metadata: Dict[str, Any],
-    ) -> str:
+    ) -> Dict[str, Any]:
+        request = self._request(
+            worker_name=worker_name,
+            previous_answer=previous_answer,
+            evaluation=evaluation,
+            context=context,
+            age=age,
+            message=message,
+            metadata=metadata,
+        )
+        completion = self.client.chat.completions.create(**request)
+        return self._result(completion)
+
+    async def aoptimise(
+        self,
+        *,
+        worker_name: str,
+        previous_answer: str,
+        evaluation: Dict[str, Any],
+        context: Dict[str, Any],
+        age: int,
+        message: str,
+        metadata: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        request = self._request(
+            worker_name=worker_name,
+            previous_answer=previous_answer,
+            evaluation=evaluation,
+            context=context,
+            age=age,
+            message=message,
+            metadata=metadata,
+        )
+        completion = await self.client.chat.completions.create(**request)
+        return self._result(completion)
+
+    def _request(
+        self,
+        *,
+        worker_name: str,
+        previous_answer: str,
+        evaluation: Dict[str, Any],
+        context: Dict[str, Any],
+        age: int,
+        message: str,
+        metadata: Dict[str, Any],
+    ) -> Dict[str, Any]:
         failed_checks = [name for name, passed in evaluation.get("checks", {}).items() if not passed]
         guidance = evaluation.get("feedback", "")
 
@@ -37,6 +85,10 @@ class ResponseOptimizer:
         )
 
         fragment = context.get("context", "")
+        checks = evaluation.get("checks") or {}
+        # A failed or unknown anchoring verdict needs the whole fragment to find a quote.
+        if self.compact and checks and checks.get("anchored", True):
+            fragment = compact_fragment(fragment, previous_answer, neighbours=1)
         title = metadata.get("title", "Libro")
         triple = '"""'
         user_prompt = (
@@ -50,16 +102,18 @@ class ResponseOptimizer:
             f"Genera una nueva respuesta completa cumpliendo los formatos solicitados para {worker_name}."
         )
 
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
-            temperature=0.4,
-            max_tokens=400,
-        )
+            "temperature": 0.4,
+            "max_tokens": 400,
+        }
 
+    @staticmethod
+    def _result(completion: Any) -> Dict[str, Any]:
         usage = extract_usage(completion)
         answer = completion.choices[0].message.content.strip()
         return {"content": answer, "usage": usage}
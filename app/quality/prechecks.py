@@ -0,0 +1,132 @@
+"""Rule-based checks that run before the LLM evaluator.
+
+Some checklist items can be settled from the text alone: whether a quoted
+passage really appears in the fragment and whether the answer keeps the
+sections each worker is asked for. Each check returns ``True``, ``False`` or
+``None`` when the rules cannot tell; only definite results are acted upon.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from app.quality.evaluator import CHECKLISTS
+
+QUOTE_PATTERN = re.compile(r'"([^"\n]+)"|“([^”\n]+)”|«([^»\n]+)»|‘([^’\n]+)’|(?<!\w)\'([^\'\n]+)\'(?!\w)')
+ELLIPSIS_PATTERN = re.compile(r"\.\.\.|…")
+NUMBERED_SECTION_PATTERN = re.compile(r"^\s*[*_#]*\s*([1-3])\s*[.)]", re.MULTILINE)
+EVAL_HEADINGS = ("Literal", "Inferencial", "Crítica")
+MIN_QUOTE_WORDS = 3
+
+PRECHECK_FEEDBACK = {
+    "structure": "Respeta las secciones del formato solicitado.",
+}
+
+
+def _normalise(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", stripped))
+
+
+def _quotes(candidate: str) -> List[str]:
+    quotes = []
+    for match in QUOTE_PATTERN.finditer(candidate):
+        quote = next(group for group in match.groups() if group is not None)
+        # A quote shortened with an ellipsis is checked piece by piece.
+        for piece in ELLIPSIS_PATTERN.split(quote):
+            normalised = _normalise(piece)
+            if len(normalised.split()) >= MIN_QUOTE_WORDS:
+                quotes.append(normalised)
+    return quotes
+
+
+def check_anchored(candidate: str, fragment: str) -> Optional[bool]:
+    """True when a quoted passage appears verbatim in the fragment.
+
+    Anything else is left to the evaluator: quotes that do not match may be
+    faithful paraphrases, and an answer without a recognisable quote may
+    still cite the text in a way these rules miss (a very short quote, other
+    quotation marks).
+    """
+    quotes = _quotes(candidate)
+    if not quotes:
+        return None
+    haystack = _normalise(fragment)
+    if any(quote in haystack for quote in quotes):
+        return True
+    return None
+
+
+def check_numbered_sections(candidate: str, count: int = 3) -> bool:
+    """True when the answer has the sections ``1.`` to ``count.``."""
+    found = {int(number) for number in NUMBERED_SECTION_PATTERN.findall(candidate)}
+    return found.issuperset(range(1, count + 1))
+
+
+def check_eval_headings(candidate: str) -> bool:
+    """True when the Literal, Inferencial and Crítica headings are present."""
+    headings = {
+        _normalise(line.lstrip("#"))
+        for line in candidate.splitlines()
+        if line.lstrip().startswith("#")
+    }
+    return all(_normalise(heading) in headings for heading in EVAL_HEADINGS)
+
+
+def run_prechecks(worker_name: str, candidate: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the local checks for a candidate and the resulting verdict.
+
+    The verdict is ``"fail"`` when any check failed outright, which is enough
+    to send the candidate to the optimizer; otherwise it is ``"undecided"``
+    and the LLM evaluator still runs.
+    """
+    fragment = context.get("context", "")
+    checks: Dict[str, Optional[bool]] = {}
+    if worker_name == "TutorWorker":
+        checks["anchored"] = check_anchored(candidate, fragment)
+        checks["structure"] = check_numbered_sections(candidate)
+    elif worker_name == "VocabWorker":
+        # The vocabulary format does not ask for a quote: only a match counts.
+        checks["anchored"] = check_anchored(candidate, fragment) or None
+    elif worker_name == "EvalWorker":
+        checks["structure"] = check_eval_headings(candidate)
+
+    # Only items the evaluator also scores may decide the verdict.
+    checklist = CHECKLISTS.get(worker_name, [])
+    failed = [name for name, passed in checks.items() if passed is False and name in checklist]
+    return {
+        "checks": checks,
+        "verdict": "fail" if failed else "undecided",
+        "feedback": " ".join(PRECHECK_FEEDBACK[name] for name in failed),
+    }
+
+
+def failed_evaluation(precheck: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the evaluation handed to the optimizer when a pre-check failed."""
+    return {
+        "checks": {name: bool(passed) for name, passed in precheck["checks"].items() if passed is not None},
+        "feedback": precheck["feedback"],
+        "passed": False,
+        "usage": None,
+        "prechecked": True,
+    }
+
+
+def apply_prechecks(worker_name: str, evaluation: Dict[str, Any], precheck: Dict[str, Any]) -> Dict[str, Any]:
+    """Let definite local results override the evaluator on the same items."""
+    checklist = CHECKLISTS.get(worker_name, [])
+    overrides = {
+        name: passed
+        for name, passed in precheck["checks"].items()
+        if passed is not None and name in checklist
+    }
+    if not overrides:
+        return evaluation
+    checks = {**evaluation.get("checks", {}), **overrides}
+    return {
+        **evaluation,
+        "checks": checks,
+        "passed": all(checks.get(item, False) for item in checklist) if checklist else True,
+    }
@@ -0,0 +1,140 @@
+"""Thread-safe in-memory cache with configurable eviction, TTL and a memory budget."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+EVICTION_POLICIES = ("lru", "fifo", "lfu")
+
+
+class MemoryCache:
+    """Bounded mapping with ``lru``, ``fifo`` or ``lfu`` eviction.
+
+    ``max_entries`` and ``max_bytes`` bound the cache; the size of each value
+    is estimated with ``sizeof``. Entries older than ``ttl_seconds`` are
+    treated as misses. Hit, miss and eviction counters are kept for metrics.
+
+    Every policy evicts in O(1): ``lfu`` keeps the keys in buckets by hit
+    count and evicts from the lowest one, least recently promoted first.
+    """
+
+    def __init__(
+        self,
+        *,
+        policy: str = "lru",
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        sizeof: Callable[[Any], int] = lambda value: 1,
+    ) -> None:
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Política de evicción desconocida: {policy}")
+        self.policy = policy
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        # key -> [value, size, stored_at, hits]; order is insertion or recency.
+        self._entries: "OrderedDict[Hashable, List[Any]]" = OrderedDict()
+        # lfu only: hit count -> keys with that count, in the order they reached it.
+        self._buckets: "Dict[int, OrderedDict[Hashable, None]]" = {}
+        self._min_hits = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, _, stored_at, _ = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                self._discard(key)
+                self.misses += 1
+                return None
+            if self.policy == "lru":
+                self._entries.move_to_end(key)
+            elif self.policy == "lfu":
+                self._promote(key, entry[3])
+            entry[3] += 1
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = max(int(self.sizeof(value)), 0)
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            if self.max_entries <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+                return
+            while self._entries and (
+                len(self._entries) >= self.max_entries
+                or (self.max_bytes is not None and self._bytes + size > self.max_bytes)
+            ):
+                self._discard(self._victim())
+                self.evictions += 1
+            self._entries[key] = [value, size, time.monotonic(), 0]
+            self._bytes += size
+            if self.policy == "lfu":
+                self._buckets.setdefault(0, OrderedDict())[key] = None
+                self._min_hits = 0
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches ``predicate``; return how many."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._discard(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _victim(self) -> Hashable:
+        if self.policy == "lfu":
+            if self._min_hits not in self._buckets:
+                # The lowest bucket was emptied by a discard; only then are buckets scanned.
+                self._min_hits = min(self._buckets)
+            return next(iter(self._buckets[self._min_hits]))
+        return next(iter(self._entries))
+
+    def _promote(self, key: Hashable, hits: int) -> None:
+        bucket = self._buckets[hits]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[hits]
+            if self._min_hits == hits:
+                self._min_hits = hits + 1
+        self._buckets.setdefault(hits + 1, OrderedDict())[key] = None
+
+    def _discard(self, key: Hashable) -> None:
+        _, size, _, hits = self._entries.pop(key)
+        self._bytes -= size
+        if self.policy == "lfu":
+            bucket = self._buckets[hits]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[hits]
+
+
+# Name of the class when it only did LRU eviction (its default policy).
+LRUCache = MemoryCache
@@ -0,0 +1,243 @@
+"""Shared ``httpx`` transport for the OpenAI clients.
+
+All components talk to the API through one pooled ``httpx`` client per
+process (one sync, one async), configured with keep-alive limits, optional
+HTTP/2 and connection retries. Each component gets a view of that client with
+its own timeout through :func:`with_stage_timeout`, so the evaluator can give
+up long before image generation does without opening a separate pool.
+"""
+from __future__ import annotations
+
+import importlib.util
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator
+
+import httpx
+
+LOGGER = logging.getLogger(__name__)
+
+_POOLS: Dict[str, "PoolMetrics"] = {}
+
+
+class PoolMetrics:
+    """Request and connection counters for one instrumented transport."""
+
+    def __init__(self, *, max_connections: int, max_keepalive: int, http2: bool) -> None:
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._pool: Any = None
+        self._known: set = set()
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.connections_opened = 0
+
+    def bind(self, pool: Any) -> None:
+        """Attach the ``httpcore`` connection pool whose sockets are reported."""
+        self._pool = pool
+
+    def started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def finished(self, *, failed: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+            self._track_connections()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            connections = self._connections()
+            idle = sum(1 for connection in connections if connection.is_idle())
+            active = len(connections) - idle
+            return {
+                "http2": self.http2,
+                "max_connections": self.max_connections,
+                "max_keepalive": self.max_keepalive,
+                "connections": len(connections),
+                "active_connections": active,
+                "idle_connections": idle,
+                "utilisation": round(active / self.max_connections, 3) if self.max_connections else 0.0,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+                "connections_opened": self.connections_opened,
+            }
+
+    def _connections(self) -> list:
+        # ``httpcore`` keeps the pool behind the transport; its connection list
+        # is the only place that knows which sockets are open or idle.
+        return list(getattr(self._pool, "connections", []))
+
+    def _track_connections(self) -> None:
+        current = {id(connection) for connection in self._connections()}
+        self.connections_opened += len(current - self._known)
+        self._known = current
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body that releases the in-flight slot once it is closed."""
+
+    def __init__(self, stream: Any, metrics: PoolMetrics) -> None:
+        self._stream = stream
+        self._metrics = metrics
+        self._closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._metrics.finished()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    """Async counterpart of :class:`_TrackedStream`."""
+
+    def __init__(self, stream: Any, metrics: PoolMetrics) -> None:
+        self._stream = stream
+        self._metrics = metrics
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._metrics.finished()
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """``HTTPTransport`` that reports in-flight requests and pool usage."""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        metrics.bind(self._pool)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.metrics.started()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self.metrics.finished(failed=True)
+            raise
+        response.stream = _TrackedStream(response.stream, self.metrics)
+        return response
+
+
+class AsyncInstrumentedTransport(httpx.AsyncHTTPTransport):
+    """``AsyncHTTPTransport`` that reports in-flight requests and pool usage."""
+
+    def __init__(self, metrics: PoolMetrics, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        metrics.bind(self._pool)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.metrics.started()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            self.metrics.finished(failed=True)
+            raise
+        response.stream = _AsyncTrackedStream(response.stream, self.metrics)
+        return response
+
+
+def _transport_options(
+    *,
+    max_connections: int,
+    max_keepalive: int,
+    keepalive_expiry: float,
+    http2: bool,
+    connect_retries: int,
+) -> Dict[str, Any]:
+    if http2 and importlib.util.find_spec("h2") is None:
+        LOGGER.warning("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+        http2 = False
+    return {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        "http1": True,
+        "http2": http2,
+        "retries": connect_retries,
+    }
+
+
+def build_http_client(
+    name: str,
+    *,
+    max_connections: int = 100,
+    max_keepalive: int = 20,
+    keepalive_expiry: float = 30.0,
+    http2: bool = True,
+    connect_retries: int = 2,
+    timeout: httpx.Timeout | float = 60.0,
+) -> httpx.Client:
+    """Build the pooled sync client handed to ``OpenAI(http_client=...)``.
+
+    ``connect_retries`` only covers failures to open a connection; API errors
+    (429, 5xx, timeouts) are retried by the SDK according to ``max_retries``.
+    """
+    options = _transport_options(
+        max_connections=max_connections,
+        max_keepalive=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+        http2=http2,
+        connect_retries=connect_retries,
+    )
+    metrics = PoolMetrics(max_connections=max_connections, max_keepalive=max_keepalive, http2=options["http2"])
+    _POOLS[name] = metrics
+    return httpx.Client(transport=InstrumentedTransport(metrics, **options), timeout=timeout)
+
+
+def build_async_http_client(
+    name: str,
+    *,
+    max_connections: int = 100,
+    max_keepalive: int = 20,
+    keepalive_expiry: float = 30.0,
+    http2: bool = True,
+    connect_retries: int = 2,
+    timeout: httpx.Timeout | float = 60.0,
+) -> httpx.AsyncClient:
+    """Async counterpart of :func:`build_http_client` for ``AsyncOpenAI``."""
+    options = _transport_options(
+        max_connections=max_connections,
+        max_keepalive=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+        http2=http2,
+        connect_retries=connect_retries,
+    )
+    metrics = PoolMetrics(max_connections=max_connections, max_keepalive=max_keepalive, http2=options["http2"])
+    _POOLS[name] = metrics
+    return httpx.AsyncClient(transport=AsyncInstrumentedTransport(metrics, **options), timeout=timeout)
+
+
+def with_stage_timeout(client: Any, timeout: float, *, connect_timeout: float) -> Any:
+    """Return a view of ``client`` with its own timeout that shares the same pool."""
+    return client.with_options(timeout=httpx.Timeout(timeout, connect=min(connect_timeout, timeout)))
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """Snapshot of every instrumented pool, keyed by the name it was built with."""
+    return {name: metrics.stats() for name, metrics in _POOLS.items()}
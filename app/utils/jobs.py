@@ -0,0 +1,326 @@
+"""In-process background job queue used to move slow work off the request path.
+
+With a :class:`JobStore`, several processes (server workers) may share one
+SQLite file. A job runs only in the process that claims it, which switches
+its row from ``queued`` to ``running`` in a single ``UPDATE``; the claiming
+process then renews a lease on the row while the handler runs. Rows whose
+lease expired belong to a process that died and are queued again.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+LOGGER = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Any]
+
+JOB_FIELDS = ("id", "kind", "status", "created_at", "started_at", "finished_at", "result", "error")
+# Columns added after the first release of the store, created on open when missing.
+LEASE_COLUMNS = (("owner", "TEXT"), ("heartbeat_at", "REAL"))
+
+
+class JobStore:
+    """SQLite file that keeps jobs and their payloads across restarts.
+
+    Payloads and results must be JSON serialisable. A connection is opened
+    per operation, so the store can be shared by the pool threads and by
+    other processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+                " created_at REAL, started_at REAL, finished_at REAL,"
+                " payload TEXT, result TEXT, error TEXT)"
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+            for column, kind in LEASE_COLUMNS:
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, job: Dict[str, Any], payload: Optional[Dict[str, Any]] = None) -> None:
+        """Insert or update a job; the payload is only written when given."""
+        values = {
+            **{field: job.get(field) for field in JOB_FIELDS},
+            "result": json.dumps(job.get("result")),
+        }
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, status, created_at, started_at, finished_at, payload, result, error)"
+                " VALUES (:id, :kind, :status, :created_at, :started_at, :finished_at, :payload, :result, :error)"
+                " ON CONFLICT(id) DO UPDATE SET status = excluded.status, started_at = excluded.started_at,"
+                " finished_at = excluded.finished_at, result = excluded.result, error = excluded.error",
+                {**values, "payload": json.dumps(payload) if payload is not None else None},
+            )
+
+    def claim(self, job_id: str, owner: str) -> Optional[float]:
+        """Mark a queued job as running for ``owner``; ``None`` if another process got it first."""
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner = ?, heartbeat_at = ?"
+                " WHERE id = ? AND status = 'queued'",
+                (now, owner, now, job_id),
+            )
+        return now if cursor.rowcount == 1 else None
+
+    def renew(self, owner: str) -> None:
+        """Extend the lease on every job ``owner`` is running."""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                (time.time(), owner),
+            )
+
+    def requeue_expired(self, lease_seconds: float) -> int:
+        """Queue again the running jobs whose lease was not renewed in ``lease_seconds``."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, owner = NULL, heartbeat_at = NULL"
+                " WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (time.time() - lease_seconds,),
+            )
+        return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return one stored job without its payload."""
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def delete(self, job_ids: List[str]) -> None:
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+    def load(self, status: Optional[str] = None, created_before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Return the stored jobs, oldest first, with their payload under ``payload``.
+
+        ``status`` and ``created_before`` restrict the result to jobs in that
+        state and created before that time.
+        """
+        query = "SELECT id, kind, status, created_at, started_at, finished_at, result, error, payload FROM jobs"
+        conditions, params = [], []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if created_before is not None:
+            conditions.append("created_at < ?")
+            params.append(created_before)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._connect() as connection:
+            rows = connection.execute(query + " ORDER BY created_at", params).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(zip(JOB_FIELDS, row[:-1]))
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+            job["payload"] = json.loads(row[-1]) if row[-1] else {}
+            jobs.append(job)
+        return jobs
+
+
+class JobQueue:
+    """Run registered job kinds on a bounded thread pool and keep their status.
+
+    With a :class:`JobStore` every state change is persisted; :meth:`resume`
+    reloads the stored jobs and queues again those a restart interrupted.
+    Server entry points call it once at startup; merely creating the queue
+    never runs stored jobs.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_workers: int = 2,
+        name: str = "jobs",
+        max_finished: int = 200,
+        store: Optional[JobStore] = None,
+        lease_seconds: float = 60.0,
+    ) -> None:
+        self.name = name
+        self.max_finished = max_finished
+        self.store = store
+        self.lease_seconds = lease_seconds
+        # Identifies this queue's claims in a store shared with other processes.
+        self.owner = uuid4().hex
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix=name)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._resumed = False
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    def resume(self) -> int:
+        """Load stored jobs and requeue the unfinished ones; returns how many were requeued.
+
+        Only the first call does anything. Afterwards the lease thread keeps
+        picking up jobs left behind by processes that died.
+        """
+        if self.store is None:
+            return 0
+        with self._lock:
+            if self._resumed:
+                return 0
+            self._resumed = True
+        for stored in self.store.load():
+            if stored["status"] in ("done", "failed"):
+                stored.pop("payload")
+                with self._lock:
+                    self._jobs[stored["id"]] = stored
+        with self._lock:
+            self._prune()
+        requeued = self._recover()
+        self._start_heartbeat()
+        if requeued:
+            LOGGER.info("Requeued %s interrupted %s job(s)", requeued, self.name)
+        return requeued
+
+    def _recover(self, created_before: Optional[float] = None) -> int:
+        """Queue stored jobs nobody is running; the claim in :meth:`_run` keeps each to one process."""
+        self.store.requeue_expired(self.lease_seconds)
+        requeued = 0
+        for stored in self.store.load(status="queued", created_before=created_before):
+            payload = stored.pop("payload")
+            if stored["kind"] not in self._handlers:
+                LOGGER.warning("Skipping stored job %s of unknown kind %s", stored["id"], stored["kind"])
+                continue
+            with self._lock:
+                if stored["id"] in self._jobs:
+                    continue
+                self._jobs[stored["id"]] = stored
+            self._executor.submit(self._run, stored["id"], payload)
+            requeued += 1
+        return requeued
+
+    def _start_heartbeat(self) -> None:
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(
+                target=self._renew_leases, name=f"{self.name}-lease", daemon=True
+            )
+        self._heartbeat.start()
+
+    def _renew_leases(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self.store.renew(self.owner)
+                if self._resumed:
+                    # Queued jobs older than a lease were left behind by a process that died.
+                    self._recover(created_before=time.time() - self.lease_seconds)
+            except sqlite3.Error:  # pragma: no cover - the next round retries
+                LOGGER.exception("Could not renew %s job leases", self.name)
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a job and return a snapshot of its initial status."""
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de trabajo no registrado: {kind}")
+
+        job = {
+            "id": uuid4().hex,
+            "kind": kind,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._prune()
+            snapshot = dict(job)
+        if self.store is not None:
+            self.store.save(job, payload)
+            self._start_heartbeat()
+
+        self._executor.submit(self._run, job["id"], payload)
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status; unfinished or unknown jobs are read from the store.
+
+        Another process sharing the store may have claimed the job, or may be
+        the one that queued it.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job is not None else None
+        if self.store is None or (job is not None and job["status"] in ("done", "failed")):
+            return job
+        return self.store.get(job_id) or job
+
+    def _run(self, job_id: str, payload: Dict[str, Any]) -> None:
+        started_at = time.time()
+        if self.store is not None:
+            started_at = self.store.claim(job_id, self.owner)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if started_at is None:
+                # Another process claimed it; its status is read from the store.
+                del self._jobs[job_id]
+                return
+            job["status"] = "running"
+            job["started_at"] = started_at
+            handler = self._handlers[job["kind"]]
+
+        try:
+            result = handler(payload)
+        except Exception as exc:  # pragma: no cover - surfaced through the job status
+            LOGGER.exception("Job %s (%s) failed", job_id, job["kind"])
+            updates = {"status": "failed", "error": str(exc)}
+        else:
+            updates = {"status": "done", "result": result}
+
+        with self._lock:
+            job.update(updates)
+            job["finished_at"] = time.time()
+            snapshot = dict(job)
+        if self.store is not None:
+            try:
+                self.store.save(snapshot)
+            except (TypeError, ValueError, sqlite3.Error):  # pragma: no cover - unserialisable result
+                LOGGER.exception("Could not persist job %s", job_id)
+
+    def _prune(self) -> None:
+        finished = [
+            job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")
+        ]
+        expired = finished[: max(len(finished) - self.max_finished, 0)]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired and self.store is not None:
+            self.store.delete(expired)
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._stopped.set()
+        self._executor.shutdown(wait=wait)
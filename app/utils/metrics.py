@@ -0,0 +1,104 @@
+"""In-process latency and token metrics for the orchestrator stages.
+
+Every usage event the orchestrator produces (one per model call) carries the
+stage, the model and how long the call took. :class:`StageMetrics` keeps a
+sliding window of those latencies per ``(stage, model)`` to report p50, p95
+and p99, plus running totals of calls, seconds and tokens, and renders them
+in the Prometheus text exposition format.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Tuple
+
+QUANTILES = (0.5, 0.95, 0.99)
+TOKEN_KINDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    """Nearest-rank quantile of an already sorted list."""
+    index = max(0, math.ceil(q * len(ordered)) - 1)
+    return ordered[index]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class StageMetrics:
+    """Latency window and token counters per orchestrator stage and model."""
+
+    def __init__(self, *, window: int = 2048) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def observe(self, event: Dict[str, Any]) -> None:
+        """Record a usage event with ``stage``, ``model``, ``ms`` and token counts."""
+        if event.get("ms") is None:
+            return
+        key = (str(event.get("stage", "desconocido")), str(event.get("model") or "desconocido"))
+        seconds = float(event["ms"]) / 1000
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+                self._totals[key] = {"count": 0, "seconds": 0.0, **{kind: 0 for kind in TOKEN_KINDS}}
+            samples.append(seconds)
+            totals = self._totals[key]
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            for kind in TOKEN_KINDS:
+                totals[kind] += int(event.get(kind) or 0)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Per ``(stage, model)`` quantiles over the window and lifetime totals."""
+        with self._lock:
+            items = [(key, sorted(samples), dict(self._totals[key])) for key, samples in self._samples.items()]
+        return [
+            {
+                "stage": stage,
+                "model": model,
+                "quantiles": {q: _quantile(ordered, q) for q in QUANTILES},
+                **totals,
+            }
+            for (stage, model), ordered, totals in sorted(items)
+        ]
+
+    def render(self, gauges: Iterable[Tuple[str, str, Dict[str, Any], float]] = ()) -> str:
+        """Prometheus text format; ``gauges`` adds ``(name, help, labels, value)`` samples."""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP tutor_stage_latency_seconds Latency of each orchestrator stage, per model.",
+            "# TYPE tutor_stage_latency_seconds summary",
+        ]
+        for entry in snapshot:
+            labels = {"stage": entry["stage"], "model": entry["model"]}
+            for q, value in entry["quantiles"].items():
+                lines.append(f"tutor_stage_latency_seconds{_labels({**labels, 'quantile': q})} {value:.6f}")
+            lines.append(f"tutor_stage_latency_seconds_sum{_labels(labels)} {entry['seconds']:.6f}")
+            lines.append(f"tutor_stage_latency_seconds_count{_labels(labels)} {entry['count']}")
+
+        lines += [
+            "# HELP tutor_tokens_total Tokens reported by the API, per stage, model and kind.",
+            "# TYPE tutor_tokens_total counter",
+        ]
+        for entry in snapshot:
+            for kind in TOKEN_KINDS:
+                labels = {"stage": entry["stage"], "model": entry["model"], "kind": kind.split("_")[0]}
+                lines.append(f"tutor_tokens_total{_labels(labels)} {entry[kind]}")
+
+        declared = set()
+        for name, help_text, labels, value in gauges:
+            if name not in declared:
+                declared.add(name)
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
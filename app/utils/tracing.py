@@ -0,0 +1,225 @@
+"""Lightweight request tracing with a JSON-lines exporter.
+
+Each orchestrator request opens a root :class:`Span`; every model call,
+retrieval and cache lookup becomes a child span with its own attributes
+(stage, retry, tokens, prompt size, cache hits). Spans of a trace are kept in
+memory until the root ends, and only then does the :class:`Tracer` decide
+whether to write them: a random ``sample_rate`` share of requests is kept,
+plus every request slower than ``slow_ms`` or ending in an error, so the
+critical path of slow requests can be rebuilt offline from the file. Kept
+traces are written by a background thread, so exporting never blocks a
+request or the event loop of the async driver.
+"""
+from __future__ import annotations
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+_CURRENT_SPAN: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation within a trace; usable as a context manager."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        tracer: "Tracer",
+        trace_id: str,
+        parent: Optional["Span"] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.name = name
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        # Only the root collects the spans of its trace.
+        self.spans: List[Span] = [self] if parent is None else parent.root.spans
+        if parent is not None:
+            self.spans.append(self)
+
+    @property
+    def root(self) -> "Span":
+        return self if self.parent is None else self.parent.root
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    def child(self, name: str, **attributes: Any) -> "Span":
+        return Span(name, tracer=self.tracer, trace_id=self.trace_id, parent=self, attributes=attributes)
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+        return self
+
+    def end(self, error: Optional[str] = None) -> None:
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+        self.error = error
+        if self.parent is None:
+            self.tracer.finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            "start": round(self.start_time, 6),
+            "duration_ms": self.duration_ms,
+            "status": "error" if self.error else ("ok" if self.duration_ms is not None else "unfinished"),
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.end(error=repr(exc) if exc is not None else None)
+
+
+class _NoopSpan:
+    """Stand-in used when tracing is off, so callers never check for ``None``."""
+
+    trace_id = None
+    span_id = None
+    recording = False
+
+    def child(self, name: str, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def set(self, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def end(self, error: Optional[str] = None) -> None:
+        return None
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonlExporter:
+    """Append each span of a kept trace as one JSON line to ``path``.
+
+    :meth:`export` only serialises and queues the lines; a daemon thread
+    appends them to the file, batching whatever accumulated meanwhile.
+    Pending lines are flushed at interpreter exit.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in spans)
+        self._queue.put(lines)
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="trace-exporter", daemon=True)
+                    self._writer.start()
+
+    def flush(self) -> None:
+        """Block until every queued trace is on disk."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write("".join(batch))
+            except OSError:
+                LOGGER.exception("Could not write %d traces to %s", len(batch), self.path)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class Tracer:
+    """Create root spans and export the traces that pass sampling."""
+
+    def __init__(
+        self,
+        exporter: JsonlExporter,
+        *,
+        sample_rate: float = 1.0,
+        slow_ms: Optional[float] = None,
+    ) -> None:
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    def start_trace(self, name: str, **attributes: Any) -> Span:
+        return Span(name, tracer=self, trace_id=uuid.uuid4().hex, attributes=attributes)
+
+    def keep(self, root: Span) -> bool:
+        if root.error:
+            return True
+        if self.slow_ms is not None and (root.duration_ms or 0) >= self.slow_ms:
+            return True
+        return random.random() < self.sample_rate
+
+    def finish(self, root: Span) -> None:
+        kept = self.keep(root)
+        root.set(sampled=kept)
+        if kept:
+            self.exporter.export([span.to_dict() for span in root.spans])
+
+
+def current_span() -> Span | _NoopSpan:
+    """The span code running now belongs to, or :data:`NOOP_SPAN`."""
+    return _CURRENT_SPAN.get() or NOOP_SPAN
+
+
+def start_span(name: str, **attributes: Any) -> Span | _NoopSpan:
+    """Open a child of :func:`current_span`; end it or use it in a ``with`` block."""
+    return current_span().child(name, **attributes)
+
+
+@contextmanager
+def use_span(span: Span | _NoopSpan) -> Iterator[None]:
+    """Make ``span`` the current span for the duration of the block."""
+    token = _CURRENT_SPAN.set(span if span.recording else None)
+    try:
+        yield
+    finally:
+        _CURRENT_SPAN.reset(token)
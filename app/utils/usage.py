@@ -13,6 +13,9 @@ def extract_usage(completion: Any) -> Optional[Dict[str, int | str]]:
     prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
     completion_tokens = getattr(usage, "completion_tokens", None) or 0
     total_tokens = getattr(usage, "total_tokens", None) or 0
+    # Prompt tokens served from the provider's prefix cache (billed at a discount).
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
     model = getattr(completion, "model", "") or "desconocido"
 
     try:
@@ -27,10 +30,15 @@ def extract_usage(completion: Any) -> Optional[Dict[str, int | str]]:
         total_tokens = int(total_tokens)
     except (TypeError, ValueError):  # pragma: no cover - defensive conversion
         total_tokens = prompt_tokens + completion_tokens
+    try:
+        cached_tokens = int(cached_tokens)
+    except (TypeError, ValueError):  # pragma: no cover - defensive conversion
+        cached_tokens = 0
 
     return {
         "model": model,
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "total_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
     }
@@ -2,22 +2,35 @@ from __future__ import annotations
 
 from typing import Any, Dict
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-from app.utils.usage import extract_usage
+from app.quality.evaluator import CHECKLISTS
+from app.workers.prompting import cacheable_messages
+from app.workers.self_check import arun_completion, run_completion
 
 
 EVAL_GENERATOR_PROMPT = (
     "Eres un diseñador de evaluaciones lectoras para niños. "
     "Debes elaborar bloques de preguntas literal, inferencial y crítica con retroalimentación. "
-    "Ajusta la extensión, dificultad y ejemplos a la edad entregada."
+    "Ajusta la extensión, dificultad y ejemplos a la edad entregada. Incluye variación en "
+    "formatos (opción múltiple, respuesta corta) y retroalimentación.\n\n"
+    "Genera preguntas de comprensión siguiendo este formato:\n"
+    "### Literal\n"
+    "1. Pregunta...\n"
+    "   - Tipo de respuesta y distractores si aplica.\n"
+    "   - Retroalimentación o pista.\n"
+    "### Inferencial\n"
+    "...\n"
+    "### Crítica\n"
+    "...\n"
+    "Incluye un cierre con sugerencias para el docente."
 )
 
 
 class EvalWorker:
     name = "EvalWorker"
 
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI):
         self.client = client
 
     def run(
@@ -27,6 +40,30 @@ class EvalWorker:
         age: int,
         context: Dict[str, str],
         metadata: Dict[str, Any],
+        self_check: bool = False,
+    ) -> Dict[str, Any]:
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        return run_completion(self.client, request, context, CHECKLISTS[self.name] if self_check else None)
+
+    async def arun(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
+        self_check: bool = False,
+    ) -> Dict[str, Any]:
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        return await arun_completion(self.client, request, context, CHECKLISTS[self.name] if self_check else None)
+
+    def _request(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
     ) -> Dict[str, Any]:
         if age <= 8:
             age_guidance = (
@@ -41,44 +78,18 @@ class EvalWorker:
                 "Profundiza en análisis crítico, conecta con experiencias adolescentes y pide argumentar."
             )
 
-        system_prompt = (
-            f"{EVAL_GENERATOR_PROMPT} El material corresponde a estudiantes de {age} años. "
-            f"{age_guidance} Incluye variación en formatos (opción múltiple, respuesta corta) "
-            "y retroalimentación."
-        )
-
-        fragment = context.get("context", "")
-        title = metadata.get("title", "Libro")
-        triple = '"""'
-        user_prompt = (
-            f"Libro: {title}\n"
-            f"Fragmento de referencia:\n{triple}{fragment}{triple}\n\n"
-            "Genera preguntas de comprensión siguiendo este formato:\n"
-            "### Literal\n"
-            "1. Pregunta...\n"
-            "   - Tipo de respuesta y distractores si aplica.\n"
-            "   - Retroalimentación o pista.\n"
-            "### Inferencial\n"
-            "...\n"
-            "### Crítica\n"
-            "...\n"
-            "Incluye un cierre con sugerencias para el docente."
-        )
-
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-            max_tokens=500,
+        messages = cacheable_messages(
+            EVAL_GENERATOR_PROMPT,
+            title=metadata.get("title", "Libro"),
+            opening=context.get("book_opening", ""),
+            fragment_label="Fragmento de referencia",
+            fragment=context.get("context", ""),
+            request=f"El material corresponde a estudiantes de {age} años. {age_guidance}",
         )
 
-        answer = completion.choices[0].message.content.strip()
-        usage = extract_usage(completion)
         return {
-            "content": answer,
-            "anchor": context.get("anchor", ""),
-            "usage": usage,
+            "model": "gpt-3.5-turbo",
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 500,
         }
@@ -1,9 +1,22 @@
 """Worker encargado de generar ilustraciones coherentes con el libro."""
 from __future__ import annotations
 
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from app.nlp.tokens import IMAGE_GENERATION_FRAGMENT_TOKENS, truncate_to_tokens
+
+DEFAULT_IMAGE_SIZE = "1024x1024"
+# Sizes accepted by gpt-image-1; anything smaller is produced locally as a thumbnail.
+API_IMAGE_SIZES = ("1024x1024", "1536x1024", "1024x1536")
+QUALITY_PRESETS = {"draft": "low", "standard": "medium", "high": "high"}
+MAX_VARIANTS = 4
+IMAGE_PRESETS: Dict[str, Dict[str, Any]] = {
+    "single": {"variants": 1, "sizes": ["1024x1024", "256x256"]},
+    "worksheet": {"variants": 4, "sizes": ["1024x1024", "256x256"], "quality": "draft"},
+    "poster": {"variants": 1, "sizes": ["1024x1536", "512x512"], "quality": "high"},
+}
 
 
 def _compose_visual_prompt(
@@ -14,7 +27,7 @@ def _compose_visual_prompt(
     fragment: str,
 ) -> str:
     safe_fragment = fragment.strip()
-    trimmed_fragment = safe_fragment[:900] if safe_fragment else ""
+    trimmed_fragment = truncate_to_tokens(safe_fragment, IMAGE_GENERATION_FRAGMENT_TOKENS) if safe_fragment else ""
 
     guidance = (
         "Create a single illustrated scene for a children's book. The illustration must be "
@@ -44,7 +57,7 @@ def _compose_visual_prompt(
 class ImageWorker:
     name = "ImageWorker"
 
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI):
         self.client = client
 
     def run(
@@ -55,6 +68,83 @@ class ImageWorker:
         fragment: str,
         metadata: Dict[str, Any],
         context: Dict[str, str],
+        n: int = 1,
+        size: str = DEFAULT_IMAGE_SIZE,
+        quality: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        request = self._request(
+            prompt=prompt,
+            age=age,
+            fragment=fragment,
+            metadata=metadata,
+            context=context,
+            n=n,
+            size=size,
+            quality=quality,
+        )
+        response = self.client.images.generate(**request)
+        return self._result(response, request)
+
+    async def arun(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        fragment: str,
+        metadata: Dict[str, Any],
+        context: Dict[str, str],
+        n: int = 1,
+        size: str = DEFAULT_IMAGE_SIZE,
+        quality: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        request = self._request(
+            prompt=prompt,
+            age=age,
+            fragment=fragment,
+            metadata=metadata,
+            context=context,
+            n=n,
+            size=size,
+            quality=quality,
+        )
+        response = await self.client.images.generate(**request)
+        return self._result(response, request)
+
+    def generation_request(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        fragment: str,
+        metadata: Dict[str, Any],
+        context: Dict[str, str],
+        n: int = 1,
+        size: str = DEFAULT_IMAGE_SIZE,
+        quality: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Return the ``images.generate`` arguments :meth:`run` would send, without calling the API."""
+        return self._request(
+            prompt=prompt,
+            age=age,
+            fragment=fragment,
+            metadata=metadata,
+            context=context,
+            n=n,
+            size=size,
+            quality=quality,
+        )
+
+    def _request(
+        self,
+        *,
+        prompt: str,
+        age: int,
+        fragment: str,
+        metadata: Dict[str, Any],
+        context: Dict[str, str],
+        n: int = 1,
+        size: str = DEFAULT_IMAGE_SIZE,
+        quality: Optional[str] = None,
     ) -> Dict[str, Any]:
         title = metadata.get("title", "Libro")
         composed_prompt = _compose_visual_prompt(
@@ -64,19 +154,37 @@ class ImageWorker:
             fragment=fragment or context.get("context", ""),
         )
 
-        image_size = "1024x1024"
-        response = self.client.images.generate(
-            model="gpt-image-1",
-            prompt=composed_prompt,
-            size=image_size,
-        )
-
-        image_data = response.data[0]
-        image_b64: Optional[str] = getattr(image_data, "b64_json", None)
-        revised_prompt: Optional[str] = getattr(image_data, "revised_prompt", None)
+        if size not in API_IMAGE_SIZES:
+            raise ValueError(f"Tamaño de imagen no soportado: {size}")
 
-        if not image_b64:
+        request: Dict[str, Any] = {
+            "model": "gpt-image-1",
+            "prompt": composed_prompt,
+            "size": size,
+        }
+        # Only non-default options are sent, so single images keep their cache keys.
+        if n > 1:
+            request["n"] = min(n, MAX_VARIANTS)
+        if quality:
+            request["quality"] = QUALITY_PRESETS.get(quality, quality)
+        return request
+
+    @staticmethod
+    def _result(response: Any, request: Dict[str, Any]) -> Dict[str, Any]:
+        image_size = request["size"]
+        variants: List[Dict[str, Any]] = [
+            {
+                "image_b64": getattr(image_data, "b64_json", None),
+                "revised_prompt": getattr(image_data, "revised_prompt", None),
+            }
+            for image_data in response.data
+        ]
+        variants = [variant for variant in variants if variant["image_b64"]]
+
+        if not variants:
             raise RuntimeError("La generación de imagen no devolvió datos válidos.")
+        image_b64: str = variants[0]["image_b64"]
+        revised_prompt: Optional[str] = variants[0]["revised_prompt"]
 
         try:
             width_str, height_str = image_size.split("x", maxsplit=1)
@@ -96,8 +204,9 @@ class ImageWorker:
             "mime_type": "image/png",
             "width": width,
             "height": height,
-            "prompt_used": composed_prompt,
+            "prompt_used": request["prompt"],
             "revised_prompt": revised_prompt,
+            "variants": variants,
             "usage": usage,
         }
         return payload
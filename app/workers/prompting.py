@@ -0,0 +1,45 @@
+"""Prompt layout shared by the text workers.
+
+Provider-side prompt caching reuses the longest prefix two requests have in
+common. The messages are therefore ordered from the most to the least
+stable part: the worker instructions and answer format (the same for every
+request), then the book title and fragment (the same while a session keeps
+asking about the same passage), and only then the reader's age and the
+student's request. Anything appended later, such as the self-check
+instructions, goes after that variable suffix.
+
+``opening`` is opt-in (``BOOK_PREFIX_TOKENS``): the start of the book, the
+same for every request on it, placed after the title so that models whose
+provider caches prefixes of 1024 tokens or more can reach that minimum.
+"""
+from __future__ import annotations
+
+from typing import Dict, List
+
+TRIPLE_QUOTE = '"""'
+
+
+def cacheable_messages(
+    instructions: str,
+    *,
+    title: str,
+    fragment_label: str,
+    fragment: str,
+    request: str,
+    opening: str = "",
+) -> List[Dict[str, str]]:
+    """System and user messages with the stable prefix first and ``request`` last."""
+    user_content = f"Libro: {title}\n"
+    if opening:
+        user_content += (
+            "Inicio del libro (solo como contexto general; las citas salen del fragmento):\n"
+            f"{TRIPLE_QUOTE}{opening}{TRIPLE_QUOTE}\n\n"
+        )
+    user_content += (
+        f"{fragment_label}:\n{TRIPLE_QUOTE}{fragment}{TRIPLE_QUOTE}\n\n"
+        f"{request}"
+    )
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": user_content},
+    ]
@@ -0,0 +1,108 @@
+"""Generate-and-self-check mode shared by the text workers.
+
+The worker is asked for a JSON object with the answer and its own checklist
+verdict, so the common case needs a single completion instead of a worker
+call followed by a ``ResponseEvaluator`` call. :func:`run_completion` and
+:func:`arun_completion` run a worker request in either mode.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional
+
+from openai import AsyncOpenAI, OpenAI
+
+from app.utils.usage import extract_usage
+
+SELF_CHECK_EXTRA_TOKENS = 120
+
+
+def with_self_check(request: Dict[str, Any], checklist: List[str]) -> Dict[str, Any]:
+    """Return a copy of ``request`` that asks for the answer plus a self-evaluation."""
+    checklist_entries = ", ".join(f'"{item}": true/false' for item in checklist)
+    instructions = (
+        "\n\nDevuelve solo un JSON válido con la forma:\n"
+        "{\n"
+        '  "answer": "respuesta completa con el formato pedido",\n'
+        f"  \"checks\": {{{checklist_entries}}},\n"
+        '  "confidence": número entre 0 y 1,\n'
+        '  "feedback": "observaciones breves"\n'
+        "}\n"
+        "Evalúa tu propia respuesta con la lista de chequeo; si dudas de un criterio, márcalo como false."
+    )
+    messages = [dict(message) for message in request["messages"]]
+    messages[-1]["content"] = f"{messages[-1]['content']}{instructions}"
+    return {
+        **request,
+        "messages": messages,
+        "max_tokens": request.get("max_tokens", 0) + SELF_CHECK_EXTRA_TOKENS,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def apply_self_check(result: Dict[str, Any], checklist: List[str]) -> Dict[str, Any]:
+    """Split a self-checked completion into the answer and its verdict.
+
+    Output that is not the expected JSON is kept as the answer with
+    ``self_check`` set to ``None``, so the orchestrator falls back to the
+    external evaluator.
+    """
+    raw = result.get("content", "")
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError:
+        parsed = None
+    if not isinstance(parsed, dict) or not str(parsed.get("answer", "")).strip():
+        return {**result, "self_check": None}
+
+    checks = parsed.get("checks") if isinstance(parsed.get("checks"), dict) else {}
+    try:
+        confidence = min(1.0, max(0.0, float(parsed.get("confidence", 0.0))))
+    except (TypeError, ValueError):
+        confidence = 0.0
+    return {
+        **result,
+        "content": str(parsed["answer"]).strip(),
+        "self_check": {
+            "checks": {item: bool(checks.get(item, False)) for item in checklist},
+            "confidence": confidence,
+            "feedback": str(parsed.get("feedback", "")),
+        },
+    }
+
+
+def _completion_result(
+    completion: Any, context: Dict[str, str], checklist: Optional[List[str]]
+) -> Dict[str, Any]:
+    result = {
+        "content": completion.choices[0].message.content.strip(),
+        "anchor": context.get("anchor", ""),
+        "usage": extract_usage(completion),
+    }
+    return apply_self_check(result, checklist) if checklist is not None else result
+
+
+def run_completion(
+    client: OpenAI,
+    request: Dict[str, Any],
+    context: Dict[str, str],
+    checklist: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Run a worker request; with a ``checklist`` the worker also grades its answer."""
+    if checklist is not None:
+        request = with_self_check(request, checklist)
+    completion = client.chat.completions.create(**request)
+    return _completion_result(completion, context, checklist)
+
+
+async def arun_completion(
+    client: AsyncOpenAI,
+    request: Dict[str, Any],
+    context: Dict[str, str],
+    checklist: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Async variant of :func:`run_completion`."""
+    if checklist is not None:
+        request = with_self_check(request, checklist)
+    completion = await client.chat.completions.create(**request)
+    return _completion_result(completion, context, checklist)
@@ -0,0 +1,35 @@
+"""Helpers to stream chat completions token by token."""
+from __future__ import annotations
+
+from typing import Any, Dict, Generator, Optional, Tuple
+
+from openai import OpenAI
+
+from app.utils.usage import extract_usage
+
+
+def stream_completion(
+    client: OpenAI,
+    request: Dict[str, Any],
+) -> Generator[str, None, Tuple[str, Optional[Dict[str, int | str]]]]:
+    """Yield the text deltas of a completion and return ``(content, usage)``.
+
+    The usage arrives in a final chunk without choices when the request asks
+    for ``stream_options={"include_usage": True}``.
+    """
+    stream = client.chat.completions.create(
+        **request,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    parts = []
+    usage = None
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = extract_usage(chunk)
+        for choice in getattr(chunk, "choices", None) or []:
+            delta = getattr(choice.delta, "content", None)
+            if delta:
+                parts.append(delta)
+                yield delta
+    return "".join(parts).strip(), usage
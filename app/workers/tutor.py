@@ -1,24 +1,32 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, Generator
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-from app.utils.usage import extract_usage
+from app.quality.evaluator import CHECKLISTS
+from app.workers.prompting import cacheable_messages
+from app.workers.self_check import arun_completion, run_completion
+from app.workers.streaming import stream_completion
 
 TUTOR_PROMPT = (
     "Eres un tutor pedagógico experto en comprensión lectora infantil. "
     "Utiliza el fragmento del libro para responder de manera clara y motivadora. "
     "Debes: 1) explicar la respuesta con lenguaje amigable, 2) mencionar explícitamente "
     "la cita textual de apoyo, 3) cerrar con una mini-pregunta para invitar a la reflexión. "
-    "Adapta ejemplos, vocabulario y extensión de acuerdo con la edad recibida."
+    "Adapta ejemplos, vocabulario y extensión de acuerdo con la edad recibida "
+    "y evita información fuera del fragmento.\n\n"
+    "Responde siguiendo este formato claro:\n"
+    "1. Explicación principal (2-3 frases).\n"
+    "2. Referencia textual: cita exacta entre comillas del fragmento entregado.\n"
+    "3. Mini-pregunta motivadora."
 )
 
 
 class TutorWorker:
     name = "TutorWorker"
 
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI):
         self.client = client
 
     def run(
@@ -28,8 +36,50 @@ class TutorWorker:
         age: int,
         context: Dict[str, str],
         metadata: Dict[str, Any],
+        self_check: bool = False,
     ) -> Dict[str, Any]:
         """Generate a response anchored to the provided context."""
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        return run_completion(self.client, request, context, CHECKLISTS[self.name] if self_check else None)
+
+    async def arun(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
+        self_check: bool = False,
+    ) -> Dict[str, Any]:
+        """Async variant of :meth:`run` for an ``AsyncOpenAI`` client."""
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        return await arun_completion(self.client, request, context, CHECKLISTS[self.name] if self_check else None)
+
+    def stream(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
+    ) -> Generator[str, None, Dict[str, Any]]:
+        """Stream the response; yields text deltas and returns the :meth:`run` payload."""
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        answer, usage = yield from stream_completion(self.client, request)
+        return {
+            "content": answer,
+            "anchor": context.get("anchor", ""),
+            "usage": usage,
+        }
+
+    def _request(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
+    ) -> Dict[str, Any]:
         if age <= 8:
             age_guidance = (
                 "Usa frases cortas (máx. 12 palabras), vocabulario concreto y compara con"
@@ -46,39 +96,22 @@ class TutorWorker:
                 " la adolescencia temprana y evita tecnicismos innecesarios."
             )
 
-        system_prompt = (
-            f"{TUTOR_PROMPT} El lector tiene {age} años. "
-            f"{age_guidance} Ajusta la complejidad, longitud y tono para esa edad y evita"
-            " información fuera del fragmento."
-        )
-
-        fragment = context.get("context", "")
-        title = metadata.get("title", "Libro")
-        triple = '"""'
-        user_content = (
-            f"Libro: {title}\n"
-            f"Fragmento relevante:\n{triple}{fragment}{triple}\n\n"
-            f"Pregunta del estudiante: {message}\n\n"
-            "Responde siguiendo este formato claro:\n"
-            "1. Explicación principal (2-3 frases).\n"
-            "2. Referencia textual: cita exacta entre comillas del fragmento entregado.\n"
-            "3. Mini-pregunta motivadora."
-        )
-
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content},
-            ],
-            temperature=0.6,
-            max_tokens=380,
+        messages = cacheable_messages(
+            TUTOR_PROMPT,
+            title=metadata.get("title", "Libro"),
+            opening=context.get("book_opening", ""),
+            fragment_label="Fragmento relevante",
+            fragment=context.get("context", ""),
+            request=(
+                f"El lector tiene {age} años. {age_guidance} Ajusta la complejidad,"
+                " longitud y tono para esa edad.\n\n"
+                f"Pregunta del estudiante: {message}"
+            ),
         )
 
-        answer = completion.choices[0].message.content.strip()
-        usage = extract_usage(completion)
         return {
-            "content": answer,
-            "anchor": context.get("anchor", ""),
-            "usage": usage,
+            "model": "gpt-3.5-turbo",
+            "messages": messages,
+            "temperature": 0.6,
+            "max_tokens": 380,
         }
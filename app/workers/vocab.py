@@ -1,23 +1,31 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, Generator
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-from app.utils.usage import extract_usage
+from app.quality.evaluator import CHECKLISTS
+from app.workers.prompting import cacheable_messages
+from app.workers.self_check import arun_completion, run_completion
+from app.workers.streaming import stream_completion
 
 
 VOCAB_PROMPT = (
     "Eres un mentor lingüístico para niños. Identifica y explica vocabulario difícil "
     "del fragmento suministrado. Usa ejemplos sencillos y cercanos a la vida del niño y "
-    "adapta la complejidad a la edad proporcionada."
+    "adapta la complejidad a la edad proporcionada. Incluye siempre un ejemplo contextual "
+    "y una mini actividad breve.\n\n"
+    "Devuelve una lista numerada con el formato:\n"
+    "- Palabra: definición amigable.\n"
+    "- Ejemplo contextual tomado o inspirado en el fragmento.\n"
+    "- Mini actividad de uso."
 )
 
 
 class VocabWorker:
     name = "VocabWorker"
 
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: OpenAI | AsyncOpenAI):
         self.client = client
 
     def run(
@@ -27,6 +35,46 @@ class VocabWorker:
         age: int,
         context: Dict[str, str],
         metadata: Dict[str, Any],
+        self_check: bool = False,
+    ) -> Dict[str, Any]:
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        return run_completion(self.client, request, context, CHECKLISTS[self.name] if self_check else None)
+
+    async def arun(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
+        self_check: bool = False,
+    ) -> Dict[str, Any]:
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        return await arun_completion(self.client, request, context, CHECKLISTS[self.name] if self_check else None)
+
+    def stream(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
+    ) -> Generator[str, None, Dict[str, Any]]:
+        request = self._request(message=message, age=age, context=context, metadata=metadata)
+        answer, usage = yield from stream_completion(self.client, request)
+        return {
+            "content": answer,
+            "anchor": context.get("anchor", ""),
+            "usage": usage,
+        }
+
+    def _request(
+        self,
+        *,
+        message: str,
+        age: int,
+        context: Dict[str, str],
+        metadata: Dict[str, Any],
     ) -> Dict[str, Any]:
         if age <= 8:
             age_guidance = (
@@ -44,38 +92,21 @@ class VocabWorker:
                 " secundaria y fomenta reflexión breve."
             )
 
-        system_prompt = (
-            f"{VOCAB_PROMPT} El lector tiene {age} años. {age_guidance} "
-            "Incluye siempre un ejemplo contextual y una mini actividad breve."
-        )
-
-        fragment = context.get("context", "")
-        title = metadata.get("title", "Libro")
-        triple = '"""'
-        user_prompt = (
-            f"Libro: {title}\n"
-            f"Fragmento para analizar:\n{triple}{fragment}{triple}\n\n"
-            f"Solicitud del estudiante: {message or 'Explica el vocabulario difícil'}\n\n"
-            "Devuelve una lista numerada con el formato:\n"
-            "- Palabra: definición amigable.\n"
-            "- Ejemplo contextual tomado o inspirado en el fragmento.\n"
-            "- Mini actividad de uso."
-        )
-
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.5,
-            max_tokens=360,
+        messages = cacheable_messages(
+            VOCAB_PROMPT,
+            title=metadata.get("title", "Libro"),
+            opening=context.get("book_opening", ""),
+            fragment_label="Fragmento para analizar",
+            fragment=context.get("context", ""),
+            request=(
+                f"El lector tiene {age} años. {age_guidance}\n\n"
+                f"Solicitud del estudiante: {message or 'Explica el vocabulario difícil'}"
+            ),
         )
 
-        answer = completion.choices[0].message.content.strip()
-        usage = extract_usage(completion)
         return {
-            "content": answer,
-            "anchor": context.get("anchor", ""),
-            "usage": usage,
+            "model": "gpt-3.5-turbo",
+            "messages": messages,
+            "temperature": 0.5,
+            "max_tokens": 360,
         }
@@ -0,0 +1,230 @@
+"""Punto de entrada ASGI con el orquestador asíncrono sobre ``AsyncOpenAI``.
+
+``/chat`` y ``/generate-questions`` se atienden con corrutinas, de modo que un
+solo proceso puede mantener cientos de sesiones de tutoría en vuelo sin fijar
+un hilo por petición. El resto de rutas se delega a la app Flask mediante
+``WsgiToAsgi``; ``python main.py`` sigue sirviendo la versión síncrona.
+
+Ejecución::
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from http.cookies import SimpleCookie
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from openai import AsyncOpenAI
+
+from app.data.storage import book_fingerprint, get_book_metadata, get_book_text
+from app.orchestrator.core import Orchestrator
+from app.utils.http import build_async_http_client
+from main import (
+    app,
+    build_orchestrator,
+    chat_response,
+    openai_http_options,
+    questions_response,
+    request_deadline,
+    start_background_jobs,
+)
+
+logger = logging.getLogger(__name__)
+
+_async_openai_client: AsyncOpenAI | None = None
+_async_orchestrator: Orchestrator | None = None
+
+Handler = Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[Tuple[int, Dict[str, Any]]]]
+
+
+def ensure_async_openai_client() -> AsyncOpenAI:
+    """Crea el cliente asíncrono de OpenAI usando la API key del entorno."""
+    global _async_openai_client
+    if _async_openai_client is not None:
+        return _async_openai_client
+
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise EnvironmentError(
+            "API key de OpenAI no configurada. Establece la variable de entorno OPENAI_API_KEY."
+        )
+    _async_openai_client = AsyncOpenAI(
+        http_client=build_async_http_client("openai_async", **openai_http_options()),
+        max_retries=app.config["OPENAI_MAX_RETRIES"],
+    )
+    return _async_openai_client
+
+
+def get_async_orchestrator() -> Orchestrator:
+    global _async_orchestrator
+    if _async_orchestrator is not None:
+        return _async_orchestrator
+
+    _async_orchestrator = build_orchestrator(ensure_async_openai_client())
+    return _async_orchestrator
+
+
+def read_session(scope: Dict[str, Any]) -> Dict[str, Any]:
+    """Decodifica la cookie de sesión firmada por Flask."""
+    cookie_header = ""
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookie_header = value.decode("latin-1")
+            break
+
+    cookies = SimpleCookie()
+    cookies.load(cookie_header)
+    morsel = cookies.get(app.config["SESSION_COOKIE_NAME"])
+    serializer = app.session_interface.get_signing_serializer(app)
+    if morsel is None or serializer is None:
+        return {}
+
+    max_age = int(app.permanent_session_lifetime.total_seconds())
+    try:
+        return dict(serializer.loads(morsel.value, max_age=max_age))
+    except BadSignature:
+        return {}
+
+
+async def load_book(session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Devuelve texto, título y huella del libro de la sesión sin bloquear el event loop."""
+    metadata = get_book_metadata(session_data)
+    book_text = await asyncio.to_thread(get_book_text, metadata["path"])
+    book_key = await asyncio.to_thread(book_fingerprint, metadata["path"])
+    return {"book_text": book_text, "book_title": metadata.get("title"), "book_key": book_key}
+
+
+async def chat(data: Dict[str, Any], session_data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    received_at = time.perf_counter()
+    try:
+        user_message = data.get("message", "").strip()
+        mode = data.get("mode", "explicar")
+        age = data.get("age", 9)
+        deadline = request_deadline(data)
+
+        if not user_message:
+            return 400, {"error": "Mensaje vacío."}
+
+        book = await load_book(session_data)
+        orchestrator = get_async_orchestrator()
+        result = await orchestrator.ahandle(
+            {
+                "mode": mode,
+                "message": user_message,
+                "age": age,
+                "deadline_seconds": deadline,
+                "received_at": received_at,
+                **book,
+            }
+        )
+        return 200, chat_response(result)
+
+    except (FileNotFoundError, ValueError) as e:
+        return 400, {"error": str(e)}
+    except EnvironmentError as e:
+        return 500, {"error": str(e)}
+    except Exception as e:
+        logger.exception("Error en /chat")
+        return 500, {"error": f"Error en /chat: {str(e)}"}
+
+
+async def generate_questions(
+    data: Dict[str, Any], session_data: Dict[str, Any]
+) -> Tuple[int, Dict[str, Any]]:
+    received_at = time.perf_counter()
+    try:
+        age = data.get("age", 9)
+        deadline = request_deadline(data)
+
+        book = await load_book(session_data)
+        orchestrator = get_async_orchestrator()
+        result = await orchestrator.ahandle(
+            {
+                "mode": "evaluar",
+                "message": "Genera preguntas de comprensión lectora",
+                "age": age,
+                "deadline_seconds": deadline,
+                "received_at": received_at,
+                **book,
+            }
+        )
+        return 200, questions_response(result)
+
+    except (FileNotFoundError, ValueError) as e:
+        return 400, {"error": str(e)}
+    except EnvironmentError as e:
+        return 500, {"error": str(e)}
+    except Exception as e:
+        logger.exception("Error en /generate-questions")
+        return 500, {"error": f"Error en /generate-questions: {str(e)}"}
+
+
+ASYNC_ROUTES: Dict[Tuple[str, str], Handler] = {
+    ("POST", "/chat"): chat,
+    ("POST", "/generate-questions"): generate_questions,
+}
+
+wsgi_application = WsgiToAsgi(app)
+
+
+async def read_json_body(receive: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def send_json(send: Callable[[Dict[str, Any]], Awaitable[None]], status: int, payload: Dict[str, Any]) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(body)).encode("ascii")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive: Callable, send: Callable) -> None:
+    """Reanuda los trabajos de imagen al arrancar cada worker del servidor ASGI."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.to_thread(start_background_jobs)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            data = await read_json_body(receive)
+            status, payload = await handler(data, read_session(scope))
+            await send_json(send, status, payload)
+            return
+    await wsgi_application(scope, receive, send)
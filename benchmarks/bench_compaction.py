@@ -0,0 +1,84 @@
+"""Prompt tokens sent by the quality loop with and without compaction.
+
+Simulates a tutor answer that fails the first two evaluations: three
+evaluator calls and two optimizer calls over the same retrieved fragment,
+which is the worst case of the default ``max_retries=2``.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_compaction
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from app.nlp.compaction import split_sentences
+from app.nlp.rag import build_context
+from app.nlp.tokens import count_tokens
+from app.quality.evaluator import ResponseEvaluator
+from app.quality.optimizer import ResponseOptimizer
+from benchmarks.bench_rag import QUERIES, make_book
+
+WORKER = "TutorWorker"
+# The second evaluation still fails on clarity, so the optimizer keeps the anchoring.
+EVALUATION = {
+    "checks": {"anchored": True, "clarity": False, "structure": True, "safety": True},
+    "feedback": "Usa frases más cortas.",
+}
+
+
+def make_answer(fragment: str, revision: int) -> str:
+    """A tutor answer in the requested format that quotes one sentence of the fragment."""
+    quotable = [sentence for sentence in split_sentences(fragment) if len(sentence.split()) >= 6]
+    quote = " ".join(quotable[revision % len(quotable)].split()[:12]) if quotable else fragment[:80]
+    return (
+        "1. El protagonista vive una aventura en el bosque y aprende a confiar en sus amigos.\n"
+        f'2. Referencia textual: "{quote}"\n'
+        "3. ¿Qué harías tú en su lugar?"
+    )
+
+
+def prompt_tokens(request: Dict[str, Any]) -> int:
+    return sum(count_tokens(message["content"]) for message in request["messages"])
+
+
+def loop_tokens(compact: bool, context: Dict[str, str], query: str) -> List[int]:
+    evaluator = ResponseEvaluator(None, compact=compact)
+    optimizer = ResponseOptimizer(None, compact=compact)
+    tokens = []
+    for retry in range(3):
+        candidate = make_answer(context["context"], retry)
+        tokens.append(prompt_tokens(evaluator._request(worker_name=WORKER, candidate=candidate, context=context)))
+        if retry < 2:
+            request = optimizer._request(
+                worker_name=WORKER,
+                previous_answer=candidate,
+                evaluation=EVALUATION,
+                context=context,
+                age=9,
+                message=query,
+                metadata={"title": "Libro"},
+            )
+            tokens.append(prompt_tokens(request))
+    return tokens
+
+
+def main() -> None:
+    book = make_book()
+    print("Prompt tokens for 3 evaluations + 2 optimisations (full -> compacted):")
+    total_full = total_compact = 0
+    for query in QUERIES:
+        context = build_context(book, query)
+        full = loop_tokens(False, context, query)
+        compact = loop_tokens(True, context, query)
+        total_full += sum(full)
+        total_compact += sum(compact)
+        print(
+            f"{query!r}: fragment {count_tokens(context['context'])} tokens | "
+            f"{sum(full)} -> {sum(compact)} ({1 - sum(compact) / sum(full):.0%} less)"
+        )
+    print(f"Total: {total_full} -> {total_compact} ({1 - total_compact / total_full:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
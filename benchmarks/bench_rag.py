@@ -0,0 +1,142 @@
+"""Micro-benchmarks for book retrieval.
+
+Compares chunk scoring with ``list.count`` against the term-frequency
+counters of the index, and the latency of the ``heuristic`` and ``bm25``
+scorers of ``build_context`` on the Python and NumPy backends. Before
+timing, the library's scores and heuristic ranking are checked against the
+pre-index scorer, kept verbatim in ``legacy_score_chunk``.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_rag
+"""
+from __future__ import annotations
+
+import math
+import random
+import time
+from typing import Callable, List
+
+from app.nlp import rag
+from app.nlp.rag import (
+    BACKENDS,
+    CONTEXT_CHUNK_OVERLAP,
+    CONTEXT_CHUNK_SIZE,
+    SCORERS,
+    RetrievalIndex,
+    _chunk_text,
+    _normalise,
+    _score_counts,
+    _tokenise,
+)
+
+VOCABULARY = (
+    "el la que de y en un una los las se por con para su al lo como más pero sus le ya "
+    "zorro bosque niña niño río casa árbol luna sol estrella camino montaña escuela "
+    "caminó pensó dijo quería miraba corrió encontró miedo alegría amigo abuela pequeño "
+    "grande noche día agua viento protagonista aventura secreto puerta jardín ciudad"
+).split()
+
+QUERIES = [
+    "¿Quién es el protagonista de la historia?",
+    "¿Qué encontró la niña en el bosque?",
+    "¿Por qué el zorro tenía miedo de la noche?",
+]
+
+
+def make_book(words: int = 120_000, seed: int = 7) -> str:
+    """Build a synthetic Spanish-like text roughly the size of a 300-page reader."""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    for _ in range(words):
+        word = rng.choice(VOCABULARY)
+        parts.append(word + "." if rng.random() < 0.07 else word)
+    return " ".join(parts)
+
+
+def legacy_score_chunk(chunk: str, query_tokens: List[str]) -> float:
+    """``_score_chunk`` as it was before the index, kept verbatim as the reference."""
+    if not query_tokens:
+        return 0.0
+    chunk_tokens = _tokenise(chunk)
+    if not chunk_tokens:
+        return 0.0
+    hits = sum(chunk_tokens.count(token) for token in query_tokens)
+    if hits == 0:
+        return 0.0
+    # Inverse length factor to prefer concise passages
+    return hits / math.sqrt(len(chunk_tokens))
+
+
+def legacy_scores(chunks: List[str], query_tokens: List[str]) -> List[float]:
+    """Scoring as it was before the index: re-tokenise and ``list.count`` per query token."""
+    return [legacy_score_chunk(chunk, query_tokens) for chunk in chunks]
+
+
+def legacy_ranking(chunks: List[str], query_tokens: List[str], limit: int) -> List[int]:
+    """Ids of the best chunks in the order the pre-index ``build_context`` picked them."""
+    scored = sorted(
+        ((score, chunk_id) for chunk_id, score in enumerate(legacy_scores(chunks, query_tokens))),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+    return [chunk_id for score, chunk_id in scored if score > 0][:limit]
+
+
+def counter_scores(index: RetrievalIndex, query_tokens: List[str]) -> List[float]:
+    """The library's ``_score_counts`` over the index counters, on every chunk for a fair comparison."""
+    return [
+        _score_counts(term_freqs, length, query_tokens)
+        for term_freqs, length in zip(index.term_freqs, index.lengths)
+    ]
+
+
+def best_of(runs: int, func: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main(runs: int = 5) -> None:
+    book = make_book()
+    chunks = _chunk_text(_normalise(book), chunk_size=CONTEXT_CHUNK_SIZE, overlap=CONTEXT_CHUNK_OVERLAP)
+    index = RetrievalIndex(book)
+    index_seconds = best_of(1, lambda: RetrievalIndex(book))
+
+    print(f"Synthetic book: {len(book.split())} words, {len(chunks)} chunks")
+    print(f"Index build (once per book): {index_seconds * 1000:.1f} ms")
+    for query in QUERIES:
+        query_tokens = _tokenise(query)
+        assert legacy_scores(chunks, query_tokens) == counter_scores(index, query_tokens)
+        for backend in BACKENDS:
+            if backend != "numpy" or rag.np is not None:
+                assert index.ranked(query_tokens, limit=3, scorer="heuristic", backend=backend) == legacy_ranking(
+                    chunks, query_tokens, 3
+                ), backend
+        legacy = best_of(runs, lambda: legacy_scores(chunks, query_tokens))
+        counters = best_of(runs, lambda: counter_scores(index, query_tokens))
+        print(
+            f"{query!r}: list.count {legacy * 1000:.1f} ms | "
+            f"counters {counters * 1000:.2f} ms | x{legacy / counters:.0f}"
+        )
+
+    print("Scorer latency per query (index already built):")
+    for query in QUERIES:
+        query_tokens = _tokenise(query)
+        timings = {
+            f"{scorer}/{backend}": best_of(
+                runs, lambda: index.search(query_tokens, limit=3, scorer=scorer, backend=backend)
+            )
+            for scorer in SCORERS
+            for backend in BACKENDS
+            if backend != "numpy" or rag.np is not None
+        }
+        summary = " | ".join(f"{label} {seconds * 1000:.2f} ms" for label, seconds in timings.items())
+        print(f"{query!r}: {summary}")
+
+
+if __name__ == "__main__":
+    main()
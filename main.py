@@ -1,24 +1,37 @@
 from __future__ import annotations
 
+import json
 import logging
+import math
 import os
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 from uuid import uuid4
 
-from flask import Flask, jsonify, render_template, request, session
+from flask import Flask, Response, jsonify, render_template, request, send_file, session, stream_with_context
 from werkzeug.utils import secure_filename
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from app.data.images import THUMBNAIL_SIZES, ImageCache, ImageStore
+from app.data.ingestion import INGEST_JOB, ingest_book
 from app.data.storage import (
+    add_invalidation_listener,
     allowed_file,
-    extract_text_from_pdf,
+    book_fingerprint,
+    check_pdf,
+    configure_extraction,
     get_book_metadata,
+    get_book_text,
+    invalidate_text_cache,
     load_book_text,
     store_book_metadata,
 )
+from app.orchestrator.cache import ResponseCache
 from app.orchestrator.core import Orchestrator
-from app.nlp.rag import build_context
+from app.nlp.rag import build_context, configure_context_cache, invalidate_book, validate_retrieval
+from app.nlp.tokens import BOOK_PREFIX_TOKENS, CONTEXT_TOKEN_BUDGET
 from app.nlp.visual_prompt import generate_book_image_prompt
 from app.quality.evaluator import ResponseEvaluator
 from app.quality.optimizer import ResponseOptimizer
@@ -27,7 +40,11 @@ from app.quality.image_prompt_optimizer import ImagePromptOptimizer
 from app.workers.evaluator_gen import EvalWorker
 from app.workers.tutor import TutorWorker
 from app.workers.vocab import VocabWorker
-from app.workers.image import ImageWorker
+from app.workers.image import API_IMAGE_SIZES, IMAGE_PRESETS, MAX_VARIANTS, QUALITY_PRESETS, ImageWorker
+from app.utils.http import build_http_client, pool_stats, with_stage_timeout
+from app.utils.jobs import JobQueue, JobStore
+from app.utils.metrics import StageMetrics
+from app.utils.tracing import JsonlExporter, Tracer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,12 +55,85 @@ app.secret_key = os.urandom(24)
 # Configuración de subida
 app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["MAX_CONTENT_LENGTH"] = 50 * 1024 * 1024  # 50 MB
+app.config["INGESTION_WORKERS"] = int(os.environ.get("INGESTION_WORKERS", "2"))
+app.config["PDF_EXTRACTION_WORKERS"] = int(os.environ.get("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+app.config["PDF_PARALLEL_MIN_PAGES"] = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "64"))
+app.config["RAG_SCORER"] = os.environ.get("RAG_SCORER", "heuristic")
+app.config["RAG_BACKEND"] = os.environ.get("RAG_BACKEND", "python")
+app.config["CONTEXT_TOKEN_BUDGET"] = int(os.environ.get("CONTEXT_TOKEN_BUDGET", str(CONTEXT_TOKEN_BUDGET)))
+app.config["BOOK_PREFIX_TOKENS"] = int(os.environ.get("BOOK_PREFIX_TOKENS", str(BOOK_PREFIX_TOKENS)))
+app.config["RAG_CACHE_MAX_ENTRIES"] = int(os.environ.get("RAG_CACHE_MAX_ENTRIES", "4096"))
+app.config["RAG_CACHE_MAX_BYTES"] = int(os.environ.get("RAG_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+app.config["RAG_CACHE_TTL_SECONDS"] = float(os.environ.get("RAG_CACHE_TTL_SECONDS", "21600"))
+app.config["RESPONSE_CACHE_SIZE"] = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))
+app.config["RESPONSE_CACHE_POLICY"] = os.environ.get("RESPONSE_CACHE_POLICY", "lru")
+app.config["RESPONSE_CACHE_TTL_SECONDS"] = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+app.config["SPECULATIVE_OPTIMIZER"] = os.environ.get("SPECULATIVE_OPTIMIZER", "0").lower() in ("1", "true", "yes")
+app.config["QUALITY_PRECHECKS"] = os.environ.get("QUALITY_PRECHECKS", "1").lower() in ("1", "true", "yes")
+app.config["WORKER_SELF_CHECK"] = os.environ.get("WORKER_SELF_CHECK", "0").lower() in ("1", "true", "yes")
+app.config["SELF_CHECK_SAMPLE_RATE"] = float(os.environ.get("SELF_CHECK_SAMPLE_RATE", "0.1"))
+app.config["SELF_CHECK_MIN_CONFIDENCE"] = float(os.environ.get("SELF_CHECK_MIN_CONFIDENCE", "0.8"))
+app.config["PROMPT_COMPACTION"] = os.environ.get("PROMPT_COMPACTION", "0").lower() in ("1", "true", "yes")
+app.config["REQUEST_DEADLINE_SECONDS"] = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "0"))
+app.config["RETRY_ROUND_ESTIMATE_SECONDS"] = float(os.environ.get("RETRY_ROUND_ESTIMATE_SECONDS", "4"))
+app.config["IMAGE_STORE_FOLDER"] = os.environ.get("IMAGE_STORE_FOLDER", os.path.join("uploads", ".images"))
+app.config["IMAGE_STORE_MAX_BYTES"] = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+app.config["IMAGE_STORE_MAX_AGE_SECONDS"] = float(os.environ.get("IMAGE_STORE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+app.config["IMAGE_CACHE_MAX_AGE"] = int(os.environ.get("IMAGE_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+# Cuántos bytes de imágenes puede reutilizar la caché; el disco lo limita IMAGE_STORE_MAX_BYTES.
+# IMAGE_CACHE_MAX_BYTES es el nombre anterior de esta opción.
+app.config["IMAGE_CACHE_REUSE_BYTES"] = int(
+    os.environ.get("IMAGE_CACHE_REUSE_BYTES", os.environ.get("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+)
+app.config["IMAGE_JOB_WORKERS"] = int(os.environ.get("IMAGE_JOB_WORKERS", "2"))
+app.config["IMAGE_JOB_STORE"] = os.environ.get("IMAGE_JOB_STORE", os.path.join("uploads", ".jobs", "image_jobs.sqlite3"))
+app.config["TRACE_FILE"] = os.environ.get("TRACE_FILE", os.path.join("uploads", ".traces", "orchestrator.jsonl"))
+app.config["TRACE_SAMPLE_RATE"] = float(os.environ.get("TRACE_SAMPLE_RATE", "0.05"))
+app.config["TRACE_SLOW_MS"] = float(os.environ.get("TRACE_SLOW_MS", "8000"))
+app.config["METRICS_WINDOW"] = int(os.environ.get("METRICS_WINDOW", "2048"))
+app.config["OPENAI_MAX_CONNECTIONS"] = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+app.config["OPENAI_MAX_KEEPALIVE"] = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "20"))
+app.config["OPENAI_KEEPALIVE_EXPIRY"] = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30"))
+app.config["OPENAI_HTTP2"] = os.environ.get("OPENAI_HTTP2", "1").lower() in ("1", "true", "yes")
+app.config["OPENAI_MAX_RETRIES"] = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+app.config["OPENAI_CONNECT_RETRIES"] = int(os.environ.get("OPENAI_CONNECT_RETRIES", "2"))
+app.config["OPENAI_CONNECT_TIMEOUT"] = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+app.config["OPENAI_TIMEOUTS"] = {
+    "worker": float(os.environ.get("OPENAI_TIMEOUT_WORKER", "30")),
+    "evaluator": float(os.environ.get("OPENAI_TIMEOUT_EVALUATOR", "10")),
+    "optimizer": float(os.environ.get("OPENAI_TIMEOUT_OPTIMIZER", "20")),
+    "image": float(os.environ.get("OPENAI_TIMEOUT_IMAGE", "120")),
+}
+
+# Un scorer o backend mal escrito falla al arrancar, no en cada /chat
+app.config["RAG_SCORER"], app.config["RAG_BACKEND"] = validate_retrieval(
+    app.config["RAG_SCORER"], app.config["RAG_BACKEND"]
+)
+configure_extraction(
+    max_workers=app.config["PDF_EXTRACTION_WORKERS"],
+    min_pages_parallel=app.config["PDF_PARALLEL_MIN_PAGES"],
+)
+configure_context_cache(
+    max_entries=app.config["RAG_CACHE_MAX_ENTRIES"],
+    max_bytes=app.config["RAG_CACHE_MAX_BYTES"],
+    ttl_seconds=app.config["RAG_CACHE_TTL_SECONDS"],
+)
+# Índices y contextos memorizados se descartan cuando el PDF se elimina o se reemplaza
+add_invalidation_listener(invalidate_book)
 
 if not os.path.exists(app.config["UPLOAD_FOLDER"]):
     os.makedirs(app.config["UPLOAD_FOLDER"])
 
 _openai_client: OpenAI | None = None
 _orchestrator: Orchestrator | None = None
+_response_cache: ResponseCache | None = None
+_job_queue: JobQueue | None = None
+_image_job_queue: JobQueue | None = None
+_image_job_queue_lock = threading.Lock()
+_image_store: ImageStore | None = None
+_image_cache: ImageCache | None = None
+_stage_metrics: StageMetrics | None = None
+_tracer: Tracer | None = None
 
 
 def uploads_directory() -> str:
@@ -143,36 +233,348 @@ def ensure_openai_client() -> OpenAI:
         raise EnvironmentError(
             "API key de OpenAI no configurada. Establece la variable de entorno OPENAI_API_KEY."
         )
-    _openai_client = OpenAI()
+    _openai_client = OpenAI(
+        http_client=build_http_client("openai", **openai_http_options()),
+        max_retries=app.config["OPENAI_MAX_RETRIES"],
+    )
     return _openai_client
 
 
-def get_orchestrator() -> Orchestrator:
-    global _orchestrator
-    if _orchestrator is not None:
-        return _orchestrator
+def openai_http_options() -> Dict[str, object]:
+    """Límites del pool, HTTP/2 y reintentos de conexión compartidos por los clientes OpenAI."""
+    return {
+        "max_connections": app.config["OPENAI_MAX_CONNECTIONS"],
+        "max_keepalive": app.config["OPENAI_MAX_KEEPALIVE"],
+        "keepalive_expiry": app.config["OPENAI_KEEPALIVE_EXPIRY"],
+        "http2": app.config["OPENAI_HTTP2"],
+        "connect_retries": app.config["OPENAI_CONNECT_RETRIES"],
+        "timeout": app.config["OPENAI_TIMEOUTS"]["worker"],
+    }
+
+
+def stage_client(client: OpenAI | AsyncOpenAI, stage: str) -> OpenAI | AsyncOpenAI:
+    """Devuelve el cliente con el timeout de la etapa, reutilizando el mismo pool de conexiones."""
+    return with_stage_timeout(
+        client,
+        app.config["OPENAI_TIMEOUTS"][stage],
+        connect_timeout=app.config["OPENAI_CONNECT_TIMEOUT"],
+    )
+
+
+def get_response_cache() -> ResponseCache | None:
+    global _response_cache
+    if _response_cache is not None or app.config["RESPONSE_CACHE_SIZE"] <= 0:
+        return _response_cache
+
+    _response_cache = ResponseCache(
+        max_entries=app.config["RESPONSE_CACHE_SIZE"],
+        ttl_seconds=app.config["RESPONSE_CACHE_TTL_SECONDS"],
+        policy=app.config["RESPONSE_CACHE_POLICY"],
+    )
+    add_invalidation_listener(_response_cache.invalidate_book)
+    return _response_cache
+
 
-    client = ensure_openai_client()
+def build_orchestrator(client: OpenAI | AsyncOpenAI) -> Orchestrator:
+    """Construye workers y componentes de calidad sobre un cliente OpenAI síncrono o asíncrono."""
+    worker_client = stage_client(client, "worker")
+    evaluator_client = stage_client(client, "evaluator")
+    optimizer_client = stage_client(client, "optimizer")
     workers: Dict[str, object] = {
-        TutorWorker.name: TutorWorker(client),
-        VocabWorker.name: VocabWorker(client),
-        EvalWorker.name: EvalWorker(client),
-        ImageWorker.name: ImageWorker(client),
+        TutorWorker.name: TutorWorker(worker_client),
+        VocabWorker.name: VocabWorker(worker_client),
+        EvalWorker.name: EvalWorker(worker_client),
+        ImageWorker.name: ImageWorker(stage_client(client, "image")),
     }
-    evaluator = ResponseEvaluator(client)
-    optimizer = ResponseOptimizer(client)
-    image_prompt_evaluator = ImagePromptEvaluator(client)
-    image_prompt_optimizer = ImagePromptOptimizer(client)
-    _orchestrator = Orchestrator(
+    evaluator = ResponseEvaluator(evaluator_client, compact=app.config["PROMPT_COMPACTION"])
+    optimizer = ResponseOptimizer(optimizer_client, compact=app.config["PROMPT_COMPACTION"])
+    image_prompt_evaluator = ImagePromptEvaluator(evaluator_client)
+    image_prompt_optimizer = ImagePromptOptimizer(optimizer_client)
+    return Orchestrator(
         workers=workers,
         evaluator=evaluator,
         optimizer=optimizer,
         image_prompt_evaluator=image_prompt_evaluator,
         image_prompt_optimizer=image_prompt_optimizer,
+        retrieval_scorer=app.config["RAG_SCORER"],
+        retrieval_backend=app.config["RAG_BACKEND"],
+        response_cache=get_response_cache(),
+        speculative=app.config["SPECULATIVE_OPTIMIZER"],
+        prechecks=app.config["QUALITY_PRECHECKS"],
+        self_check=app.config["WORKER_SELF_CHECK"],
+        self_check_sample_rate=app.config["SELF_CHECK_SAMPLE_RATE"],
+        self_check_min_confidence=app.config["SELF_CHECK_MIN_CONFIDENCE"],
+        deadline_seconds=app.config["REQUEST_DEADLINE_SECONDS"] or None,
+        retry_round_estimate=app.config["RETRY_ROUND_ESTIMATE_SECONDS"],
+        image_cache=get_image_cache(),
+        context_tokens=app.config["CONTEXT_TOKEN_BUDGET"],
+        book_prefix_tokens=app.config["BOOK_PREFIX_TOKENS"],
+        metrics=get_stage_metrics(),
+        tracer=get_tracer(),
     )
+
+
+def get_orchestrator() -> Orchestrator:
+    global _orchestrator
+    if _orchestrator is not None:
+        return _orchestrator
+
+    _orchestrator = build_orchestrator(ensure_openai_client())
     return _orchestrator
 
 
+def chat_response(result: Dict[str, object]) -> Dict[str, object]:
+    """Arma el cuerpo JSON de /chat a partir del resultado del orquestador."""
+    response_payload = {
+        "response": result.get("content"),
+        "trace": result.get("trace"),
+    }
+    if result.get("anchor"):
+        response_payload["anchor"] = result.get("anchor")
+    if result.get("usage"):
+        response_payload["usage"] = result.get("usage")
+    return response_payload
+
+
+def questions_response(result: Dict[str, object]) -> Dict[str, object]:
+    """Arma el cuerpo JSON de /generate-questions a partir del resultado del orquestador."""
+    return {
+        "questions": result.get("content"),
+        "trace": result.get("trace"),
+        "usage": result.get("usage"),
+    }
+
+
+def get_image_store() -> ImageStore:
+    global _image_store
+    if _image_store is None:
+        _image_store = ImageStore(
+            os.path.abspath(app.config["IMAGE_STORE_FOLDER"]),
+            max_bytes=app.config["IMAGE_STORE_MAX_BYTES"] or None,
+            max_age_seconds=app.config["IMAGE_STORE_MAX_AGE_SECONDS"] or None,
+        )
+    return _image_store
+
+
+def get_image_cache() -> ImageCache | None:
+    global _image_cache
+    if _image_cache is not None or app.config["IMAGE_CACHE_REUSE_BYTES"] <= 0:
+        return _image_cache
+
+    _image_cache = ImageCache(get_image_store(), reuse_bytes=app.config["IMAGE_CACHE_REUSE_BYTES"])
+    return _image_cache
+
+
+def get_stage_metrics() -> StageMetrics:
+    global _stage_metrics
+    if _stage_metrics is not None:
+        return _stage_metrics
+
+    _stage_metrics = StageMetrics(window=app.config["METRICS_WINDOW"])
+    return _stage_metrics
+
+
+def get_tracer() -> Tracer | None:
+    global _tracer
+    if _tracer is not None or not app.config["TRACE_FILE"]:
+        return _tracer
+
+    _tracer = Tracer(
+        JsonlExporter(app.config["TRACE_FILE"]),
+        sample_rate=app.config["TRACE_SAMPLE_RATE"],
+        slow_ms=app.config["TRACE_SLOW_MS"] or None,
+    )
+    return _tracer
+
+
+def pool_gauges() -> Iterator[Tuple[str, str, Dict[str, str], float]]:
+    """Convierte el uso de los pools HTTP en muestras de gauge para /metrics."""
+    pools = pool_stats()
+    for state in ("active", "idle"):
+        for name, stats in pools.items():
+            yield (
+                "tutor_http_pool_connections",
+                "Open connections to the OpenAI API, per pool and state.",
+                {"pool": name, "state": state},
+                stats[f"{state}_connections"],
+            )
+    for name, stats in pools.items():
+        yield ("tutor_http_pool_in_flight", "Requests waiting for a response, per pool.", {"pool": name}, stats["in_flight"])
+    for name, stats in pools.items():
+        yield ("tutor_http_pool_utilisation", "Active connections over the pool limit.", {"pool": name}, stats["utilisation"])
+
+
+def request_deadline(data: Dict[str, object]) -> float | None:
+    """Lee el plazo opcional ``deadline_seconds`` de la solicitud.
+
+    Lanza ``ValueError`` si no es un número de segundos positivo. El orquestador
+    lo limita a ``REQUEST_DEADLINE_SECONDS`` cuando este está configurado.
+    """
+    value = data.get("deadline_seconds")
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError("deadline_seconds debe ser un número de segundos.")
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("deadline_seconds debe ser un número de segundos.")
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError("deadline_seconds debe ser un número de segundos mayor que cero.")
+    return seconds
+
+
+def sse_event(event: str, data: object) -> str:
+    """Serializa un evento en formato Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def get_job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is not None:
+        return _job_queue
+
+    _job_queue = JobQueue(max_workers=app.config["INGESTION_WORKERS"], name="ingestion")
+    _job_queue.register(INGEST_JOB, ingest_book)
+    return _job_queue
+
+
+IMAGE_JOB = "generate_image"
+
+
+def image_area(size: str) -> int:
+    width, height = size.split("x")
+    return int(width) * int(height)
+
+
+def image_options(data: Dict[str, object]) -> Dict[str, object]:
+    """Lee variantes, tamaños y calidad de la solicitud de imagen, aplicando el preset si lo hay.
+
+    Solo el tamaño mayor se pide a la API; los demás se producen como miniaturas locales.
+    """
+    preset_name = data.get("preset")
+    if preset_name and preset_name not in IMAGE_PRESETS:
+        raise ValueError(f"Preset de imagen desconocido: {preset_name}")
+    options = dict(IMAGE_PRESETS[preset_name or "single"])
+    options.update({key: data[key] for key in ("variants", "sizes", "quality") if data.get(key)})
+
+    try:
+        variants = int(options.get("variants", 1))
+    except (TypeError, ValueError):
+        raise ValueError("El número de variantes debe ser un entero.")
+    if not 1 <= variants <= MAX_VARIANTS:
+        raise ValueError(f"Se pueden pedir entre 1 y {MAX_VARIANTS} variantes.")
+
+    quality = options.get("quality")
+    if quality and quality not in QUALITY_PRESETS:
+        raise ValueError(f"Calidad de imagen desconocida: {quality}")
+
+    sizes = list(options.get("sizes") or [])
+    unknown = [size for size in sizes if size not in API_IMAGE_SIZES and size not in THUMBNAIL_SIZES]
+    if unknown:
+        raise ValueError(f"Tamaños de imagen no soportados: {', '.join(map(str, unknown))}")
+    api_sizes = [size for size in sizes if size in API_IMAGE_SIZES]
+    size = max(api_sizes, key=image_area) if api_sizes else API_IMAGE_SIZES[0]
+
+    return {
+        "variants": variants,
+        "size": size,
+        "quality": quality,
+        "thumbnails": [size for size in sizes if size in THUMBNAIL_SIZES],
+    }
+
+
+def image_response(result: Dict[str, object], thumbnails: List[str] | None = None) -> Dict[str, object] | None:
+    """Guarda las imágenes del resultado del orquestador y arma el cuerpo JSON con sus URLs."""
+    gallery = []
+    for variant in result.get("variants") or [result.get("image") or {}]:
+        mime_type = variant.get("mime_type", "image/png")
+        if variant.get("id"):
+            # El orquestador ya guardó la imagen (caché de imágenes activa).
+            stored = {"id": variant["id"], "bytes": variant.get("bytes")}
+        elif variant.get("data"):
+            stored = get_image_store().save_b64(variant["data"], mime_type)
+        else:
+            continue
+        gallery.append(
+            {
+                "id": stored["id"],
+                "url": f"/images/{stored['id']}",
+                "bytes": stored["bytes"],
+                "mime_type": mime_type,
+                "width": variant.get("width"),
+                "height": variant.get("height"),
+                "thumbnails": {size: f"/images/{stored['id']}/thumb/{size}" for size in thumbnails or []},
+            }
+        )
+    if not gallery:
+        return None
+
+    return {
+        "gallery": gallery,
+        "image": {
+            **gallery[0],
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "prompt": result.get("prompt"),
+            "revised_prompt": result.get("revised_prompt"),
+            "fragment": result.get("fragment"),
+        },
+        "trace": result.get("trace"),
+        "usage": result.get("usage"),
+    }
+
+
+def generate_image_job(payload: Dict[str, object]) -> Dict[str, object]:
+    """Genera una ilustración fuera de la solicitud HTTP a partir de la ruta del libro."""
+    book_path = payload["book_path"]
+    result = get_orchestrator().handle(
+        {
+            "mode": "imagen",
+            "prompt": payload["prompt"],
+            "age": payload.get("age", 9),
+            "fragment": payload.get("fragment", ""),
+            "variants": payload.get("variants", 1),
+            "size": payload.get("size"),
+            "quality": payload.get("quality"),
+            "book_text": get_book_text(book_path),
+            "book_title": payload.get("book_title"),
+            "book_key": book_fingerprint(book_path),
+        }
+    )
+    response_payload = image_response(result, payload.get("thumbnails"))
+    if response_payload is None:
+        raise RuntimeError("No se recibió la imagen generada.")
+    return response_payload
+
+
+def get_image_job_queue() -> JobQueue:
+    global _image_job_queue
+    if _image_job_queue is not None:
+        return _image_job_queue
+
+    # Una sola cola por proceso, aunque lleguen a la vez varias primeras solicitudes
+    with _image_job_queue_lock:
+        if _image_job_queue is None:
+            store_path = app.config["IMAGE_JOB_STORE"]
+            queue = JobQueue(
+                max_workers=app.config["IMAGE_JOB_WORKERS"],
+                name="images",
+                store=JobStore(store_path) if store_path else None,
+            )
+            queue.register(IMAGE_JOB, generate_image_job)
+            _image_job_queue = queue
+    return _image_job_queue
+
+
+def start_background_jobs() -> None:
+    """Reanuda los trabajos de imagen guardados; lo llaman los puntos de entrada del servidor.
+
+    Importar ``main`` no lanza nada. Si varios procesos comparten el almacén, cada
+    trabajo lo ejecuta solo el proceso que lo reclama.
+    """
+    get_image_job_queue().resume()
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -196,19 +598,33 @@ def upload_file():
             filepath = os.path.join(uploads_dir, filename)
             file.save(filepath)
 
+            # Un PDF ilegible se rechaza aquí, antes de que la sesión apunte a él
+            try:
+                check_pdf(filepath)
+            except ValueError as exc:
+                os.remove(filepath)
+                return jsonify({"error": str(exc)}), 400
+
             store_book_metadata(filepath, filename)
+            relative_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
 
-            # Validamos que realmente podamos extraer algo
-            _ = extract_text_from_pdf(filepath)
+            # La extracción del texto se procesa en segundo plano
+            job = get_job_queue().submit(
+                INGEST_JOB,
+                {"path": filepath, "relative_path": relative_path, "title": filename},
+            )
 
             return jsonify(
                 {
                     "success": True,
-                    "message": "Libro cargado exitosamente",
+                    "message": "Libro recibido, procesando texto",
                     "title": filename,
-                    "path": os.path.join(app.config["UPLOAD_FOLDER"], filename),
+                    "path": relative_path,
+                    "job_id": job["id"],
+                    "status": job["status"],
+                    "status_url": f"/jobs/{job['id']}",
                 }
-            ), 200
+            ), 202
 
         return jsonify({"error": "Archivo no permitido. Solo PDFs."}), 400
 
@@ -216,6 +632,14 @@ def upload_file():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str):
+    job = get_job_queue().get(job_id) or get_image_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado."}), 404
+    return jsonify(job), 200
+
+
 @app.route("/books", methods=["GET"])
 def get_books():
     try:
@@ -236,12 +660,19 @@ def book_fragment():
         book_content = load_book_text()
         metadata = get_book_metadata()
 
-        context = build_context(book_content, focus or metadata.get("title"))
+        context = build_context(
+            book_content,
+            focus or metadata.get("title"),
+            max_tokens=app.config["CONTEXT_TOKEN_BUDGET"],
+            book_key=book_fingerprint(metadata["path"]),
+            scorer=app.config["RAG_SCORER"],
+            backend=app.config["RAG_BACKEND"],
+        )
         idea_context = (context.get("context") or "").strip()
         if not idea_context:
             return jsonify({"error": "No se pudo obtener contenido del libro para generar el prompt."}), 400
 
-        client = ensure_openai_client()
+        client = stage_client(ensure_openai_client(), "worker")
         prompt_payload = generate_book_image_prompt(
             client,
             title=metadata.get("title", "Libro"),
@@ -311,6 +742,12 @@ def delete_book():
         return jsonify({"error": "El archivo especificado no existe."}), 404
 
     try:
+        # Los oyentes solo se avisan si hay texto en caché: el índice se descarta siempre.
+        fingerprint = book_fingerprint(resolved_path)
+        invalidate_book(fingerprint)
+        if _response_cache is not None:
+            _response_cache.invalidate_book(fingerprint)
+        invalidate_text_cache(resolved_path)
         os.remove(resolved_path)
     except OSError as exc:
         logger.exception("No se pudo eliminar el archivo")
@@ -326,11 +763,13 @@ def delete_book():
 
 @app.route("/chat", methods=["POST"])
 def chat():
+    received_at = time.perf_counter()
     try:
         data = request.json or {}
         user_message = data.get("message", "").strip()
         mode = data.get("mode", "explicar")
         age = data.get("age", 9)
+        deadline = request_deadline(data)
 
         if not user_message:
             return jsonify({"error": "Mensaje vacío."}), 400
@@ -346,20 +785,15 @@ def chat():
                 "age": age,
                 "book_text": book_content,
                 "book_title": metadata.get("title"),
+                "book_key": book_fingerprint(metadata["path"]),
+                "deadline_seconds": deadline,
+                "received_at": received_at,
             }
         )
 
-        response_payload = {
-            "response": result.get("content"),
-            "trace": result.get("trace"),
-        }
-        if result.get("anchor"):
-            response_payload["anchor"] = result.get("anchor")
-        if result.get("usage"):
-            response_payload["usage"] = result.get("usage")
-        return jsonify(response_payload), 200
+        return jsonify(chat_response(result)), 200
 
-    except FileNotFoundError as e:
+    except (FileNotFoundError, ValueError) as e:
         return jsonify({"error": str(e)}), 400
     except EnvironmentError as e:
         return jsonify({"error": str(e)}), 500
@@ -368,11 +802,66 @@ def chat():
         return jsonify({"error": f"Error en /chat: {str(e)}"}), 500
 
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    received_at = time.perf_counter()
+    try:
+        data = request.json or {}
+        user_message = data.get("message", "").strip()
+        mode = data.get("mode", "explicar")
+        age = data.get("age", 9)
+        deadline = request_deadline(data)
+
+        if not user_message:
+            return jsonify({"error": "Mensaje vacío."}), 400
+
+        book_content = load_book_text()
+        metadata = get_book_metadata()
+        orchestrator = get_orchestrator()
+        payload = {
+            "mode": mode,
+            "message": user_message,
+            "age": age,
+            "book_text": book_content,
+            "book_title": metadata.get("title"),
+            "book_key": book_fingerprint(metadata["path"]),
+            "deadline_seconds": deadline,
+            "received_at": received_at,
+        }
+    except (FileNotFoundError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except EnvironmentError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        logger.exception("Error en /chat/stream")
+        return jsonify({"error": f"Error en /chat/stream: {str(e)}"}), 500
+
+    def events() -> Iterator[str]:
+        try:
+            for item in orchestrator.handle_stream(payload):
+                if item["event"] == "done":
+                    yield sse_event("done", chat_response(item["data"]))
+                else:
+                    yield sse_event(item["event"], item["data"])
+        except Exception as e:
+            # Los encabezados ya se enviaron: el error viaja como un evento más.
+            logger.exception("Error en /chat/stream")
+            yield sse_event("error", {"error": f"Error en /chat/stream: {str(e)}"})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/generate-questions", methods=["POST"])
 def generate_questions():
+    received_at = time.perf_counter()
     try:
         data = request.json or {}
         age = data.get("age", 9)
+        deadline = request_deadline(data)
 
         book_content = load_book_text()
         metadata = get_book_metadata()
@@ -385,21 +874,15 @@ def generate_questions():
                 "age": age,
                 "book_text": book_content,
                 "book_title": metadata.get("title"),
+                "book_key": book_fingerprint(metadata["path"]),
+                "deadline_seconds": deadline,
+                "received_at": received_at,
             }
         )
 
-        return (
-            jsonify(
-                {
-                    "questions": result.get("content"),
-                    "trace": result.get("trace"),
-                    "usage": result.get("usage"),
-                }
-            ),
-            200,
-        )
+        return jsonify(questions_response(result)), 200
 
-    except FileNotFoundError as e:
+    except (FileNotFoundError, ValueError) as e:
         return jsonify({"error": str(e)}), 400
     except EnvironmentError as e:
         return jsonify({"error": str(e)}), 500
@@ -418,6 +901,7 @@ def generate_image():
 
         age = data.get("age", 9)
         fragment = (data.get("fragment") or "").strip()
+        options = image_options(data)
 
         book_content = load_book_text()
         metadata = get_book_metadata()
@@ -429,34 +913,18 @@ def generate_image():
                 "prompt": prompt,
                 "age": age,
                 "fragment": fragment,
+                "variants": options["variants"],
+                "size": options["size"],
+                "quality": options["quality"],
                 "book_text": book_content,
                 "book_title": metadata.get("title"),
+                "book_key": book_fingerprint(metadata["path"]),
             }
         )
 
-        image_payload = result.get("image") or {}
-        image_data = image_payload.get("data")
-        if not image_data:
+        response_payload = image_response(result, options["thumbnails"])
+        if response_payload is None:
             return jsonify({"error": "No se recibió la imagen generada."}), 500
-
-        mime_type = image_payload.get("mime_type", "image/png")
-        data_url = f"data:{mime_type};base64,{image_data}"
-        timestamp = datetime.utcnow().isoformat() + "Z"
-
-        response_payload = {
-            "image": {
-                "data_url": data_url,
-                "mime_type": mime_type,
-                "width": image_payload.get("width"),
-                "height": image_payload.get("height"),
-                "timestamp": timestamp,
-                "prompt": result.get("prompt"),
-                "revised_prompt": result.get("revised_prompt"),
-                "fragment": result.get("fragment"),
-            },
-            "trace": result.get("trace"),
-            "usage": result.get("usage"),
-        }
         return jsonify(response_payload), 200
 
     except ValueError as exc:
@@ -470,5 +938,94 @@ def generate_image():
         return jsonify({"error": f"Error al generar imagen: {exc}"}), 500
 
 
+@app.route("/image-jobs", methods=["POST"])
+def submit_image_job():
+    try:
+        data = request.json or {}
+        prompt = (data.get("prompt") or "").strip()
+        if not prompt:
+            return jsonify({"error": "El prompt de la imagen está vacío."}), 400
+
+        options = image_options(data)
+        metadata = get_book_metadata()
+        job = get_image_job_queue().submit(
+            IMAGE_JOB,
+            {
+                "prompt": prompt,
+                "age": data.get("age", 9),
+                "fragment": (data.get("fragment") or "").strip(),
+                "book_path": metadata["path"],
+                "book_title": metadata.get("title"),
+                **options,
+            },
+        )
+        return jsonify(
+            {
+                "job_id": job["id"],
+                "status": job["status"],
+                "status_url": f"/jobs/{job['id']}",
+            }
+        ), 202
+
+    except (FileNotFoundError, ValueError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception as exc:  # pragma: no cover - defensive
+        logger.exception("Error en /image-jobs")
+        return jsonify({"error": f"Error al encolar la imagen: {exc}"}), 500
+
+
+@app.route("/images/<image_id>", methods=["GET"])
+def get_image(image_id: str):
+    stored = get_image_store().locate(image_id)
+    if stored is None:
+        return jsonify({"error": "Imagen no encontrada."}), 404
+
+    # El id es el hash del contenido: sirve como ETag y la respuesta nunca cambia.
+    response = send_file(
+        stored["path"],
+        mimetype=stored["mime_type"],
+        conditional=True,
+        etag=image_id,
+        max_age=app.config["IMAGE_CACHE_MAX_AGE"],
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route("/images/<image_id>/thumb/<size>", methods=["GET"])
+def get_image_thumbnail(image_id: str, size: str):
+    stored = get_image_store().thumbnail(image_id, size)
+    if stored is None:
+        return jsonify({"error": "Miniatura no encontrada."}), 404
+
+    response = send_file(
+        stored["path"],
+        mimetype=stored["mime_type"],
+        conditional=True,
+        etag=f"{image_id}-{size}",
+        max_age=app.config["IMAGE_CACHE_MAX_AGE"],
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Uso de los pools de conexiones hacia OpenAI y latencias por etapa."""
+    return jsonify({"http_pools": pool_stats(), "stages": get_stage_metrics().snapshot()}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Métricas en formato de texto de Prometheus."""
+    body = get_stage_metrics().render(pool_gauges())
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
+    # Con el recargador de depuración, solo el proceso hijo atiende solicitudes
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_jobs()
     app.run(debug=True, host="0.0.0.0", port=5000)